@@ -0,0 +1,302 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Generator for synthetic Java source trees used by the benchmarks.
+
+The generated sources are fully determined by the scale parameters and the
+seed, so runs of the benchmark with the same parameters always process the
+same input. Classes contain nested types, enums, generics and annotations, and
+their Javadoc comments mix paragraphs, lists, tables, preformatted blocks and
+inline {@link} and {@code} tags in roughly the proportions found in real
+projects.
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import io
+import os
+import random
+import sys
+
+from optparse import OptionParser
+
+# Preset scales as (packages, classes per package, methods per class)
+scales = {
+    'small': (4, 10, 8),
+    'medium': (10, 30, 12),
+    'large': (25, 60, 16),
+}
+
+words = ('value', 'widget', 'request', 'buffer', 'index', 'handler', 'stream',
+         'record', 'session', 'context', 'element', 'result', 'factory', 'node',
+         'listener', 'channel', 'token', 'range', 'entry', 'option', 'state',
+         'timeout', 'limit', 'source', 'target', 'cache', 'queue', 'event')
+
+verbs = ('returns', 'creates', 'updates', 'removes', 'computes', 'validates',
+         'resolves', 'registers', 'converts', 'merges', 'reads', 'writes')
+
+primitive_types = ('int', 'long', 'boolean', 'double', 'String', 'byte[]')
+
+class CorpusGenerator(object):
+    def __init__(self, packages, classes, methods, seed=0):
+        self.packages = packages
+        self.classes = classes
+        self.methods = methods
+        self.random = random.Random(seed)
+
+        self.package_names = ['com.example.bench.p%d' % (i,) for i in range(packages)]
+        self.class_names = ['%s%d' % (self.capitalize(words[i % len(words)]), i)
+                            for i in range(classes)]
+
+    def capitalize(self, word):
+        return word[0].upper() + word[1:]
+
+    def word(self):
+        return self.random.choice(words)
+
+    def sentence(self, length=None):
+        length = length or self.random.randint(6, 16)
+        text = ' '.join(self.word() for _ in range(length))
+        return self.capitalize(self.random.choice(verbs)) + ' the ' + text + '.'
+
+    def type_name(self):
+        if self.random.random() < 0.6:
+            return self.random.choice(primitive_types)
+        return self.random.choice(self.class_names)
+
+    def link(self):
+        """ Return an inline {@link} to a generated type or member. """
+
+        package = self.random.choice(self.package_names)
+        cls = self.random.choice(self.class_names)
+        kind = self.random.random()
+
+        if kind < 0.4:
+            return '{@link %s}' % (cls,)
+        elif kind < 0.7:
+            return '{@link %s.%s}' % (package, cls)
+        elif kind < 0.9:
+            return '{@link %s#method%d(int)}' % (cls, self.random.randint(0, self.methods - 1))
+        else:
+            return '{@linkplain %s the %s}' % (cls, self.word())
+
+    def inline_text(self):
+        parts = []
+        for _ in range(self.random.randint(1, 3)):
+            parts.append(self.sentence())
+
+            roll = self.random.random()
+            if roll < 0.35:
+                parts.append('See ' + self.link() + '.')
+            elif roll < 0.55:
+                parts.append('Uses {@code %s.%s()} internally.' % (self.word(), self.word()))
+            elif roll < 0.7:
+                parts.append('The <b>%s</b> is <i>never</i> <code>null</code>.' % (self.word(),))
+            elif roll < 0.8:
+                parts.append('Refer to <a href="http://example.com/%s">the %s guide</a>.' %
+                             (self.word(), self.word()))
+
+        return ' '.join(parts)
+
+    def html_block(self):
+        roll = self.random.random()
+
+        if roll < 0.5:
+            return ['<p>', self.inline_text()]
+        elif roll < 0.7:
+            lines = ['<ul>']
+            for _ in range(self.random.randint(2, 5)):
+                lines.append('  <li>' + self.inline_text() + '</li>')
+            lines.append('</ul>')
+            return lines
+        elif roll < 0.85:
+            lines = ['<table border="1">',
+                     '  <tr><th>Name</th><th>Type</th><th>Description</th></tr>']
+            for _ in range(self.random.randint(2, 6)):
+                lines.append('  <tr><td>%s</td><td>%s</td><td>%s</td></tr>' %
+                             (self.word(), self.type_name(), self.sentence(5)))
+            lines.append('</table>')
+            return lines
+        else:
+            lines = ['<pre>']
+            for _ in range(self.random.randint(2, 5)):
+                lines.append('    %s.%s(%s);' % (self.word(), self.word(), self.word()))
+            lines.append('</pre>')
+            return lines
+
+    def javadoc(self, indent, blocks, params=(), returns=False, throws=False):
+        lines = [self.sentence()]
+        for _ in range(blocks):
+            lines.extend(self.html_block())
+
+        if params or returns or throws:
+            lines.append('')
+        for param in params:
+            lines.append('@param %s %s' % (param, self.inline_text()))
+        if returns:
+            lines.append('@return ' + self.inline_text())
+        if throws:
+            lines.append('@throws IllegalStateException if the %s is %s' % (self.word(), self.word()))
+        if self.random.random() < 0.3:
+            lines.append('@see ' + self.random.choice(self.class_names))
+        if self.random.random() < 0.1:
+            lines.append('@deprecated Use ' + self.link() + ' instead.')
+        if self.random.random() < 0.2:
+            lines.append('@since 1.%d' % (self.random.randint(0, 9),))
+
+        output = [indent + '/**']
+        for line in lines:
+            output.append((indent + ' * ' + line).rstrip())
+        output.append(indent + ' */')
+        return output
+
+    def method(self, indent, index):
+        params = ['%s%d' % (self.word(), i) for i in range(self.random.randint(0, 3))]
+        returns = self.random.random() < 0.7
+        throws = self.random.random() < 0.3
+        return_type = self.type_name() if returns else 'void'
+
+        lines = self.javadoc(indent, self.random.randint(0, 3), params, returns, throws)
+        if self.random.random() < 0.2:
+            lines.append(indent + '@Deprecated')
+
+        signature = ', '.join('%s %s' % (self.type_name(), param) for param in params)
+        lines.append('%spublic %s method%d(%s)%s {' % (indent, return_type, index, signature,
+                                                      ' throws IllegalStateException' if throws else ''))
+
+        # Bodies have no bearing on the output but cost time to parse
+        for i in range(self.random.randint(1, 6)):
+            lines.append('%s    int local%d = %d * %d;' % (indent, i, i, self.random.randint(1, 100)))
+        if returns:
+            lines.append('%s    return %s;' % (indent, self.default_value(return_type)))
+        lines.append(indent + '}')
+        return lines
+
+    def default_value(self, type_name):
+        return {'int': '0', 'long': '0L', 'boolean': 'false', 'double': '0.0'}.get(type_name, 'null')
+
+    def enum(self, indent, name):
+        lines = self.javadoc(indent, 1)
+        lines.append('%spublic enum %s {' % (indent, name))
+        constants = ['%s_%d' % (self.word().upper(), i) for i in range(self.random.randint(3, 8))]
+        for i, constant in enumerate(constants):
+            lines.extend(self.javadoc(indent + '    ', 0))
+            lines.append('%s    %s%s' % (indent, constant, ',' if i < len(constants) - 1 else ';'))
+        lines.append(indent + '}')
+        return lines
+
+    def nested_class(self, indent, name):
+        lines = self.javadoc(indent, 1, ['<T>'])
+        lines.append('%spublic static class %s<T> implements Comparable<%s<T>> {' % (indent, name, name))
+        lines.extend(self.javadoc(indent + '    ', 0))
+        lines.append('%s    protected T %s;' % (indent, self.word()))
+        lines.append('')
+        for i in range(self.random.randint(1, 3)):
+            lines.extend(self.method(indent + '    ', i))
+            lines.append('')
+        lines.extend(self.javadoc(indent + '    ', 0, ['other'], returns=True))
+        lines.append('%s    public int compareTo(%s<T> other) {' % (indent, name))
+        lines.append('%s        return 0;' % (indent,))
+        lines.append('%s    }' % (indent,))
+        lines.append(indent + '}')
+        return lines
+
+    def compilation_unit(self, package, name):
+        lines = ['/*', ' * Generated by the javasphinx benchmark suite.', ' */', '',
+                 'package %s;' % (package,), '',
+                 'import java.util.List;', 'import java.util.Map;', '']
+
+        lines.extend(self.javadoc('', self.random.randint(1, 4)))
+        lines.append('public class %s extends Object implements java.io.Serializable {' % (name,))
+
+        for i in range(self.random.randint(1, 4)):
+            lines.extend(self.javadoc('    ', 0))
+            lines.append('    public static final int %s_%d = %d;' % (self.word().upper(), i, i))
+            lines.append('')
+
+        lines.extend(self.javadoc('    ', 1, ['value']))
+        lines.append('    public %s(int value) {' % (name,))
+        lines.append('    }')
+        lines.append('')
+
+        for i in range(self.methods):
+            lines.extend(self.method('    ', i))
+            lines.append('')
+
+        if self.random.random() < 0.5:
+            lines.extend(self.enum('    ', 'Kind'))
+            lines.append('')
+        if self.random.random() < 0.5:
+            lines.extend(self.nested_class('    ', 'Entry'))
+            lines.append('')
+
+        lines.append('    private void internal() {')
+        lines.append('    }')
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def package_info(self, package):
+        lines = self.javadoc('', self.random.randint(1, 3))
+        lines.append('package %s;' % (package,))
+        return '\n'.join(lines) + '\n'
+
+    def generate(self, destdir):
+        """ Write the corpus below destdir and return the paths of the generated
+        source files.
+
+        """
+
+        source_files = []
+
+        for package in self.package_names:
+            package_dir = os.path.join(destdir, *package.split('.'))
+            if not os.path.isdir(package_dir):
+                os.makedirs(package_dir)
+
+            path = os.path.join(package_dir, 'package-info.java')
+            write_source(path, self.package_info(package))
+            source_files.append(path)
+
+            for name in self.class_names:
+                path = os.path.join(package_dir, name + '.java')
+                write_source(path, self.compilation_unit(package, name))
+                source_files.append(path)
+
+        return source_files
+
+def write_source(path, content):
+    f = io.open(path, 'w', encoding='utf-8', newline='\n')
+    f.write(content)
+    f.close()
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='usage: %prog [options] <output_path>')
+    parser.add_option('-s', '--scale', type='choice', choices=sorted(scales), default='small',
+                      help='Preset corpus size: %s (default: small)' % (', '.join(sorted(scales)),))
+    parser.add_option('--seed', type='int', default=0, help='Random seed (default: 0)')
+
+    (opts, args) = parser.parse_args(argv[1:])
+
+    if len(args) != 1:
+        parser.error('An output directory is required.')
+
+    source_files = CorpusGenerator(*scales[opts.scale], seed=opts.seed).generate(args[0])
+    print('Generated %d source files in %s' % (len(source_files), args[0]))
+
+if __name__ == '__main__':
+    main()
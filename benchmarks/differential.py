@@ -0,0 +1,266 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Differential check of htmlrst.Converter.
+
+Every Javadoc string (descriptions, @param, @return, @throws, @author and
+@see text) found in the given Java source trees, or in a generated corpus if
+none are given, is converted by Converter.convert(), by the full HTML
+conversion it falls back to, Converter._convert_html(), and, together with the
+other strings of its source file, by Converter.convert_many(). The results must
+be identical. Inline Javadoc tags replaced in a single scan are also compared
+against replacing them one kind at a time. With the lxml parser every string is
+also converted by the stream engine (-p stream), which must produce the same
+result; where the tree conversion fails the stream engine must fail as well.
+Randomly generated strings mixing plain text, markup, whitespace and unusual
+characters are checked as well, in batches of --batch strings, along with a
+fixed set of edge cases.
+
+The exit status is 1 if any string converts differently.
+
+    python benchmarks/differential.py [source_dir ...]
+
+"""
+
+from __future__ import print_function, unicode_literals
+from builtins import chr
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import javalang
+
+import javasphinx.htmlrst as htmlrst
+
+import corpus
+
+class Failure(object):
+    """ An exception raised by a conversion, comparing equal to failures with
+    the same exception type.
+
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+    def __eq__(self, other):
+        return isinstance(other, Failure) and type(self.exception) is type(other.exception)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'exception: %r' % (self.exception,)
+
+def iter_java_files(path):
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.java'):
+                yield os.path.join(dirpath, filename)
+
+def docblock_strings(doc):
+    if doc.description:
+        yield doc.description
+    for author in doc.authors:
+        yield author
+    for name, value in doc.params:
+        yield value
+    for exception, description in doc.throws.items():
+        yield description
+    if doc.return_doc:
+        yield doc.return_doc
+    for see in doc.tags.get('see', []):
+        yield see
+
+def collect_strings(source_dirs):
+    """ Return the docblock strings of each source file as a list of lists. """
+
+    groups = []
+
+    for source_dir in source_dirs:
+        for source_file in iter_java_files(source_dir):
+            f = open(source_file)
+            source = f.read()
+            f.close()
+
+            try:
+                ast = javalang.parse.parse(source)
+            except javalang.parser.JavaSyntaxError:
+                continue
+
+            strings = []
+            for path, node in ast.filter(javalang.tree.Documented):
+                if node.documentation:
+                    strings.extend(docblock_strings(javalang.javadoc.parse(node.documentation)))
+            groups.append(strings)
+
+    return groups
+
+# Strings the random ones rarely or never produce
+edge_cases = [
+    '\ufeff', '\ufeffhello', '\ufeff hello  world ', '\ufeff\ufeffhello', '\ufeff<b>bold</b>',
+    '\ufeff{@code x}', '\ufeff&lt;', ' \ufeffhello', 'hello\ufeff', 'a\ufeffb <i>c</i>',
+]
+
+def random_strings(count, batch, seed):
+    """ Plain text with random whitespace and characters from various ranges,
+    occasionally mixed with markup.
+
+    """
+
+    rng = random.Random(seed)
+    pieces = [' ', '  ', '\t', '\n', '\r\n', '\n \n', '\x0b', '\x0c', '\xa0', '\u2003',
+              '\u3000', '\x85', '\x1c', '\x1f', '\x00', '&', '&amp', '&lt;', '<', '>',
+              '<b>', '</b>', '<p>', '</p>', '<i>', '<br>', '<h3>', '<ul>', '<li>', '</ul>',
+              '<ol>', '<table>', '<tr>', '<th>', '<td>', '</td>', '</table>', '<pre>',
+              '</pre>', '<div>', '</div>', '<a name="x">', '<a href="#y">', '</a>',
+              '<!-- c -->', '<title>', '<meta a="b">', '<body>', '</html>', '<head>',
+              '<script>', '<style>', '<!DOCTYPE html>', '&nbsp;', '{', '}', '{@', '{@code x}', '{@link Foo}', '@',
+              '*', '`', '_', '\\', '|', ':', '..', '"', "'", '\ufeff']
+
+    groups = []
+    for i in range(count):
+        if i % batch == 0:
+            groups.append([])
+
+        parts = []
+        for _ in range(rng.randint(0, 12)):
+            roll = rng.random()
+            if roll < 0.4:
+                parts.append(rng.choice(corpus.words))
+            elif roll < 0.7:
+                parts.append(rng.choice(pieces))
+            else:
+                parts.append(chr(rng.randint(1, 0x2fff)))
+        groups[-1].append(''.join(parts))
+
+    return groups
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='usage: %prog [options] [source_dir ...]')
+    parser.add_option('-s', '--scale', type='choice', choices=sorted(corpus.scales), default='medium',
+                      help='Corpus size generated when no source directories are given (default: medium)')
+    parser.add_option('--random', type='int', default=20000,
+                      help='Number of random strings to check (default: 20000)')
+    parser.add_option('--batch', type='int', default=50,
+                      help='Number of random strings converted together by convert_many (default: 50)')
+    parser.add_option('--seed', type='int', default=0, help='Random seed (default: 0)')
+    parser.add_option('-p', '--parser', default='lxml', help='Beautiful Soup parser (default: lxml)')
+
+    (opts, source_dirs) = parser.parse_args(argv[1:])
+
+    work_dir = None
+    if not source_dirs:
+        work_dir = tempfile.mkdtemp(prefix='javasphinx-diff-')
+        corpus.CorpusGenerator(*corpus.scales[opts.scale], seed=opts.seed).generate(work_dir)
+        source_dirs = [work_dir]
+
+    try:
+        groups = collect_strings(source_dirs)
+    finally:
+        if work_dir:
+            shutil.rmtree(work_dir)
+
+    groups.append(edge_cases)
+    groups.extend(random_strings(opts.random, opts.batch, opts.seed))
+
+    converter = htmlrst.Converter(opts.parser)
+    stream_converter = htmlrst.Converter('stream') if opts.parser == 'lxml' else None
+    checked = 0
+    mismatches = 0
+    plain = 0
+    timings = {'convert': 0.0, '_convert_html': 0.0, 'convert_many': 0.0}
+    if stream_converter:
+        timings['stream'] = 0.0
+
+    def timed(name, f, *args):
+        start = time.time()
+        try:
+            return f(*args)
+        except Exception as e:
+            return Failure(e)
+        finally:
+            timings[name] += time.time() - start
+
+    def replace_sequentially(s):
+        for start, f in converter._inline_tags:
+            s = converter._preprocess_inline_javadoc_replace(start[2:], f, s)
+        return s
+
+    for strings in groups:
+        for s in strings:
+            scanned = converter._preprocess_inline_javadoc_scan(s)
+            if scanned is not None and scanned != replace_sequentially(s):
+                mismatches += 1
+                if mismatches <= 10:
+                    print('Inline tag mismatch for %r:\n  scan:       %r\n  sequential: %r' %
+                          (s, scanned, replace_sequentially(s)))
+
+        expected = [timed('_convert_html', converter._convert_html, s) for s in strings]
+        converted = [timed('convert', converter.convert, s) for s in strings]
+
+        # convert_many() raises if converting any of the strings raises
+        batch_converted = timed('convert_many', converter.convert_many, strings)
+        if not isinstance(batch_converted, list):
+            if any(isinstance(e, Failure) for e in expected):
+                batch_converted = expected
+            else:
+                batch_converted = [batch_converted] * len(strings)
+
+        for s, result, batch_result, expected_result in zip(strings, converted, batch_converted, expected):
+            checked += 1
+            if not converter._markup.search(s):
+                plain += 1
+
+            if result != expected_result or batch_result != expected_result:
+                mismatches += 1
+                if mismatches <= 10:
+                    print('Mismatch for %r:\n  convert:       %r\n  convert_many:  %r\n  _convert_html: %r' %
+                          (s, result, batch_result, expected_result))
+
+        if not stream_converter:
+            continue
+
+        # The stream engine fails differently on documents without a body
+        for s, expected_result in zip(strings, expected):
+            result = timed('stream', stream_converter._convert_html, s)
+            if isinstance(result, Failure) and isinstance(expected_result, Failure):
+                continue
+
+            if result != expected_result:
+                mismatches += 1
+                if mismatches <= 10:
+                    print('Stream engine mismatch for %r:\n  stream: %r\n  tree:   %r' %
+                          (s, result, expected_result))
+
+    print('Checked %d strings (%d plain text): %d mismatches' % (checked, plain, mismatches))
+    print(', '.join('%s: %.3f s' % (name, timings[name]) for name in sorted(timings)))
+
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
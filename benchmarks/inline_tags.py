@@ -0,0 +1,106 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Stress benchmark for the replacement of inline Javadoc tags.
+
+Each case builds docblocks of doubling size which are pathological for inline
+tag replacement, such as {@code} examples with deeply nested braces, and times
+Converter._preprocess() on them. Since the replacement runs in linear time
+the time should roughly double along with the size. The growth is summarized
+as the exponent k of the best fit time ~ size^k between the smallest and the
+largest input; the exit status is 1 if it exceeds --max-exponent for any case.
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import math
+import os
+import sys
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import javasphinx.htmlrst as htmlrst
+
+cases = [
+    ('nested-braces', lambda n: '{@code ' + '{' * n + '}' * n + '}'),
+    ('code-blocks', lambda n: '{@code ' + 'if (x) { y(); } ' * n + '}'),
+    ('open-braces', lambda n: '{@code ' + '{ x; ' * n + '}' * n + '} trailing text'),
+    ('many-tags', lambda n: 'See {@link Foo#bar(int) the bar} and {@code x} or {@literal <y>}. ' * n),
+    ('unknown-tags', lambda n: '{@inheritDoc} {@value Foo#BAR} {@docRoot}/a.html ' * n),
+    ('nested-tags', lambda n: 'See {@link Foo {@code bar}} and {@code {@literal x}}. ' * n),
+]
+
+def time_preprocess(converter, s, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        converter._preprocess(s)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('--min-size', type='int', default=1000,
+                      help='Repetitions of the pathological pattern in the smallest input (default: 1000)')
+    parser.add_option('--steps', type='int', default=5,
+                      help='Number of times the input size is doubled (default: 5)')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='Number of runs per input; the fastest is reported (default: 5)')
+    parser.add_option('--max-exponent', type='float', default=1.4,
+                      help='Largest acceptable growth exponent (default: 1.4; quadratic is 2)')
+
+    (opts, args) = parser.parse_args(argv[1:])
+
+    converter = htmlrst.Converter('lxml')
+    failures = []
+
+    print('%-14s %9s %10s %10s %8s' % ('Case', 'Size', 'Length', 'Time (s)', 'Growth'))
+
+    for name, make in cases:
+        times = []
+
+        for step in range(opts.steps + 1):
+            n = opts.min_size * 2 ** step
+            s = make(n)
+            elapsed = time_preprocess(converter, s, opts.repeat)
+
+            growth = ''
+            if times and times[-1]:
+                growth = '%7.2fx' % (elapsed / times[-1],)
+
+            print('%-14s %9d %10d %10.4f %8s' % (name, n, len(s), elapsed, growth))
+            times.append(elapsed)
+
+        if opts.steps and times[0]:
+            exponent = math.log(times[-1] / times[0]) / math.log(2 ** opts.steps)
+            print('%-14s growth exponent %.2f' % (name, exponent))
+
+            if exponent > opts.max_exponent:
+                failures.append(name)
+
+    if failures:
+        print('Superlinear growth: %s' % (', '.join(failures),))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Benchmark for javasphinx-apidoc.
+
+A synthetic corpus is generated (see corpus.py) and javasphinx-apidoc is run
+over it several times, each time into a fresh output directory. The time spent
+in each stage (discovery, reading, parsing, compiling, HTML conversion, reST
+building and writing) is taken from the apidoc instrumentation in
+javasphinx.stats and the median over all runs is reported.
+
+Results can be saved as JSON with --output and compared against a previously
+saved run with --baseline, in which case the exit status is 1 if any stage got
+slower than the allowed threshold. Options after -- are passed on to
+javasphinx-apidoc, e.g.
+
+    python benchmarks/run.py --scale medium -o results.json -- -j 4
+
+"""
+
+from __future__ import print_function, unicode_literals
+
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+# Benchmark the checkout this script is part of rather than an installed copy
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import javalang
+
+import javasphinx
+import javasphinx.apidoc as apidoc
+import javasphinx.stats as stats
+
+import corpus
+
+# Version of the results format
+results_format = 1
+
+# Stages in pipeline order, used to order reports
+stage_order = ['discover', 'read', 'cache', 'parse', 'compile', 'convert', 'build', 'write']
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def ordered_stages(stages):
+    return sorted(stages, key=lambda s: (stage_order.index(s) if s in stage_order else len(stage_order), s))
+
+def corpus_size(source_files):
+    return sum(os.path.getsize(source_file) for source_file in source_files)
+
+def run_apidoc(source_dir, output_dir, apidoc_args):
+    """ Run javasphinx-apidoc once and return the total wall time and the
+    recorder holding the time spent per stage.
+
+    """
+
+    stats.enable()
+
+    start = time.time()
+    apidoc.main(['javasphinx-apidoc', '-f', '-o', output_dir] + apidoc_args + [source_dir])
+    total = time.time() - start
+
+    return total, stats.recorder
+
+def run_benchmark(source_dir, work_dir, apidoc_args, repeat, warmup):
+    totals = []
+    wall = {}
+    cpu = {}
+    calls = {}
+
+    for i in range(warmup + repeat):
+        output_dir = os.path.join(work_dir, 'output-%d' % (i,))
+        total, recorder = run_apidoc(source_dir, output_dir, apidoc_args)
+        shutil.rmtree(output_dir)
+
+        if i < warmup:
+            continue
+
+        totals.append(total)
+        for stage in recorder.wall:
+            wall.setdefault(stage, []).append(recorder.wall[stage])
+            cpu.setdefault(stage, []).append(recorder.cpu[stage])
+            calls[stage] = recorder.calls[stage]
+
+    stages = {}
+    for stage in wall:
+        stages[stage] = {
+            'wall': median(wall[stage]),
+            'wall_min': min(wall[stage]),
+            'cpu': median(cpu[stage]),
+            'calls': calls[stage]
+        }
+
+    return {
+        'total': {'wall': median(totals), 'wall_min': min(totals), 'runs': totals},
+        'stages': stages
+    }
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'javasphinx': javasphinx.__version__,
+        'javalang': getattr(javalang, '__version__', 'unknown')
+    }
+
+def format_results(results):
+    lines = ['%-10s %10s %10s %10s %8s' % ('Stage', 'Wall (s)', 'Min (s)', 'CPU (s)', 'Calls')]
+
+    for stage in ordered_stages(results['stages']):
+        s = results['stages'][stage]
+        lines.append('%-10s %10.3f %10.3f %10.3f %8d' % (stage, s['wall'], s['wall_min'], s['cpu'], s['calls']))
+
+    total = results['total']
+    lines.append('%-10s %10.3f %10.3f' % ('total', total['wall'], total['wall_min']))
+
+    return '\n'.join(lines)
+
+def compare(results, baseline, threshold, min_delta):
+    """ Compare the median wall time of each stage against the baseline. Return
+    the report and the list of stages which got slower by more than threshold
+    percent and more than min_delta seconds.
+
+    """
+
+    lines = ['%-10s %10s %10s %9s' % ('Stage', 'Base (s)', 'Now (s)', 'Change')]
+    regressions = []
+
+    stages = dict((stage, s['wall']) for stage, s in results['stages'].items())
+    stages['total'] = results['total']['wall']
+    base_stages = dict((stage, s['wall']) for stage, s in baseline['stages'].items())
+    base_stages['total'] = baseline['total']['wall']
+
+    for stage in ordered_stages(set(stages) | set(base_stages)):
+        now = stages.get(stage, 0.0)
+        base = base_stages.get(stage, 0.0)
+
+        if base:
+            change = '%+8.1f%%' % (100.0 * (now - base) / base,)
+        else:
+            change = '%9s' % ('new',)
+
+        mark = ''
+        if now - base > min_delta and now > base * (1 + threshold / 100.0):
+            regressions.append(stage)
+            mark = '  REGRESSION'
+
+        lines.append('%-10s %10.3f %10.3f %s%s' % (stage, base, now, change, mark))
+
+    if results['corpus'] != baseline['corpus']:
+        lines.append('Warning: the baseline was recorded with a different corpus.')
+    if results['apidoc_args'] != baseline['apidoc_args']:
+        lines.append('Warning: the baseline was recorded with different apidoc options.')
+
+    return '\n'.join(lines), regressions
+
+def main(argv=sys.argv):
+    parser = OptionParser(usage='usage: %prog [options] [-- apidoc options]')
+    parser.add_option('-s', '--scale', type='choice', choices=sorted(corpus.scales), default='small',
+                      help='Preset corpus size: %s (default: small)' % (', '.join(sorted(corpus.scales)),))
+    parser.add_option('--packages', type='int', help='Number of packages, overriding the scale')
+    parser.add_option('--classes', type='int', help='Number of classes per package, overriding the scale')
+    parser.add_option('--methods', type='int', help='Number of methods per class, overriding the scale')
+    parser.add_option('--seed', type='int', default=0, help='Random seed for the corpus (default: 0)')
+    parser.add_option('-r', '--repeat', type='int', default=3,
+                      help='Number of timed runs; the median is reported (default: 3)')
+    parser.add_option('--warmup', type='int', default=1,
+                      help='Number of untimed runs before the timed ones (default: 1)')
+    parser.add_option('-o', '--output', help='Write the results as JSON to this file')
+    parser.add_option('-b', '--baseline', help='Compare the results with those saved in this file')
+    parser.add_option('--threshold', type='float', default=10.0,
+                      help='Slowdown in percent reported as a regression (default: 10)')
+    parser.add_option('--min-delta', type='float', default=0.01,
+                      help='Ignore slowdowns smaller than this many seconds (default: 0.01)')
+    parser.add_option('--keep', action='store_true', default=False,
+                      help='Keep the generated corpus and print its location')
+
+    (opts, apidoc_args) = parser.parse_args(argv[1:])
+
+    if opts.repeat < 1:
+        parser.error('At least one timed run is required.')
+
+    packages, classes, methods = corpus.scales[opts.scale]
+    packages = opts.packages or packages
+    classes = opts.classes or classes
+    methods = opts.methods or methods
+
+    work_dir = tempfile.mkdtemp(prefix='javasphinx-bench-')
+    source_dir = os.path.join(work_dir, 'src')
+
+    try:
+        generator = corpus.CorpusGenerator(packages, classes, methods, seed=opts.seed)
+        source_files = generator.generate(source_dir)
+
+        results = {
+            'format': results_format,
+            'environment': environment(),
+            'corpus': {
+                'packages': packages,
+                'classes': classes,
+                'methods': methods,
+                'seed': opts.seed,
+                'files': len(source_files),
+                'bytes': corpus_size(source_files)
+            },
+            'apidoc_args': apidoc_args,
+            'repeat': opts.repeat
+        }
+
+        print('Corpus: %(files)d files, %(bytes)d bytes' % results['corpus'])
+        results.update(run_benchmark(source_dir, work_dir, apidoc_args, opts.repeat, opts.warmup))
+    finally:
+        if opts.keep:
+            print('Corpus kept in %s' % (source_dir,))
+            for name in os.listdir(work_dir):
+                if name != 'src':
+                    shutil.rmtree(os.path.join(work_dir, name))
+        else:
+            shutil.rmtree(work_dir)
+
+    print(format_results(results))
+
+    if opts.output:
+        f = open(opts.output, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+        f.close()
+
+    if opts.baseline:
+        f = open(opts.baseline)
+        baseline = json.load(f)
+        f.close()
+
+        if baseline.get('format') != results_format:
+            sys.stderr.write('%s has an unsupported results format.\n' % (opts.baseline,))
+            sys.exit(2)
+
+        report, regressions = compare(results, baseline, opts.threshold, opts.min_delta)
+        print()
+        print(report)
+
+        if regressions:
+            print('Regressions: %s' % (', '.join(regressions),))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
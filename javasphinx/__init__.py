@@ -14,11 +14,28 @@
 # limitations under the License.
 #
 
-from .domain import JavaDomain
+__version__ = '0.9.15'
+
+from .domain import JavaDomain, load_resolved_xrefs, update_xrefs_build, save_resolved_xrefs
 from .extdoc import javadoc_role
 
 def setup(app):
     app.add_domain(JavaDomain)
 
     app.add_config_value('javadoc_url_map', dict(), '')
+    app.add_config_value('java_signature_cache', 0, '')
     app.add_role('java:extdoc', javadoc_role)
+
+    # References are resolved after the environment is saved, so the domain
+    # stores them separately for the next build
+    app.connect('builder-inited', load_resolved_xrefs)
+    app.connect('env-updated', update_xrefs_build)
+    app.connect('build-finished', save_resolved_xrefs)
+
+    # The domain merges the objects read by each process, and everything else
+    # it keeps while reading a document is in the document's temp_data
+    return {
+        'version': __version__,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
@@ -17,21 +17,37 @@
 from __future__ import print_function, unicode_literals
 
 try:
-   import cPickle as pickle
-except:
-   import pickle
-
-import hashlib
+   import queue
+except ImportError:
+   import Queue as queue
+
+import collections
+import fnmatch
+import functools
+import itertools
 import logging
+import multiprocessing
 import sys
+import threading
+import time
 import os
 import os.path
+import re
 
 from optparse import OptionParser
 
+try:
+   from os import scandir
+except ImportError:
+   scandir = None
+
 import javalang
 
+import javasphinx.cache as cache
 import javasphinx.compiler as compiler
+import javasphinx.htmlrst as htmlrst
+import javasphinx.manifest as manifest
+import javasphinx.stats as stats
 import javasphinx.util as util
 
 def encode_output(s):
@@ -40,9 +56,53 @@ def encode_output(s):
    else:
       return s.encode('utf-8')
 
+def write_file(fullpath, content):
+    """ Write content to the given file unless the file already holds exactly
+    that content. Leaving unchanged files untouched preserves their
+    modification times, so Sphinx doesn't consider them outdated.
+
+    """
+
+    content = encode_output(content)
+
+    with stats.span('write', fullpath):
+        if os.path.exists(fullpath):
+            f = open(fullpath)
+            existing = f.read()
+            f.close()
+
+            if existing == content:
+                return False
+
+        f = open(fullpath, 'w')
+        f.write(content)
+        f.close()
+
+    return True
+
+def iter_directory(path):
+    """ List a directory, yielding (name, is_dir, is_symlink) for each entry.
+    Uses os.scandir where available, which avoids a stat call per entry.
+
+    """
+
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            yield entry.name, is_dir, entry.is_symlink()
+    else:
+        for name in os.listdir(path):
+            fullpath = os.path.join(path, name)
+            yield name, os.path.isdir(fullpath), os.path.islink(fullpath)
+
 def find_source_files(input_path, excludes):
     """ Get a list of filenames for all Java source files within the given
-    directory.
+    directory. Files are listed in a stable order, independent of the order
+    in which the file system returns directory entries. Symbolic links to
+    directories are not followed.
 
     """
 
@@ -50,17 +110,95 @@ def find_source_files(input_path, excludes):
 
     input_path = os.path.normpath(os.path.abspath(input_path))
 
-    for dirpath, dirnames, filenames in os.walk(input_path):
-        if is_excluded(dirpath, excludes):
-            del dirnames[:]
+    node = excludes.lookup(input_path)
+    if node is True:
+        return java_files
+
+    stack = [(input_path, node)]
+
+    while stack:
+        dirpath, node = stack.pop()
+
+        try:
+            entries = sorted(iter_directory(dirpath))
+        except OSError:
             continue
 
-        for filename in filenames:
-            if filename.endswith(".java"):
-                java_files.append(os.path.join(dirpath, filename))
+        subdirs = []
+
+        for name, is_dir, is_symlink in entries:
+            child = node.get(name) if node else None
+            if child is True:
+                continue
+
+            fullpath = os.path.join(dirpath, name)
+
+            if is_dir:
+                if not is_symlink and not excludes.matches_pattern(fullpath):
+                    subdirs.append((fullpath, child))
+            elif name.endswith(".java") and not excludes.matches_pattern(fullpath):
+                java_files.append(fullpath)
+
+        stack.extend(reversed(subdirs))
 
     return java_files
 
+def read_source_list(path, excludes, skip_missing=False):
+    """ Read a list of source files, one per line, from the given file or from
+    standard input if path is '-'. Listed files that don't exist are reported
+    as an error, or left out if skip_missing is true.
+
+    """
+
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        try:
+            f = open(path)
+        except IOError as e:
+            util.error('Unable to read source list %s: %s', path, e.strerror)
+        lines = f.read().splitlines()
+        f.close()
+
+    java_files = []
+    missing = []
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        source_file = os.path.normpath(os.path.abspath(line))
+        if excludes.is_excluded(source_file):
+            continue
+
+        if os.path.isfile(source_file):
+            java_files.append(source_file)
+        elif not skip_missing:
+            missing.append(line)
+
+    if missing:
+        util.error('Source files listed in %s not found: %s',
+                   'standard input' if path == '-' else path, ', '.join(missing))
+
+    return java_files
+
+def discover_sources(input_paths, excludes, files_from=None, skip_missing=False):
+    """ List the source files to process, read from files_from if given and
+    found by scanning each of the input paths.
+
+    """
+
+    source_files = []
+
+    if files_from:
+        source_files.extend(read_source_list(files_from, excludes, skip_missing))
+
+    for input_path in input_paths:
+        source_files.extend(find_source_files(input_path, excludes))
+
+    return source_files
+
 def write_toc(packages, opts):
     doc = util.Document()
     doc.add_heading(opts.toc_title, '=')
@@ -79,48 +217,48 @@ def write_toc(packages, opts):
         sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
         sys.exit(1)
 
-    f = open(fullpath, 'w')
-    f.write(encode_output(doc.build()))
-    f.close()
+    write_file(fullpath, doc.build())
 
-def write_documents(packages, documents, sources, opts):
-    package_contents = dict()
+def document_basename(name):
+    return name.replace('.', '-')
 
-    # Write individual documents
-    for fullname, (package, name, document) in documents.items():
-        if is_package_info_doc(name):
-            continue
+def document_path(package, name, suffix):
+    """ Return the path of the document for a type, relative to the output
+    directory.
 
-        package_path = package.replace('.', os.sep)
-        filebasename = name.replace('.', '-')
-        filename = filebasename + '.' + opts.suffix
-        dirpath = os.path.join(opts.destdir, package_path)
-        fullpath = os.path.join(dirpath, filename)
+    """
 
-        if not os.path.exists(dirpath):
-            os.makedirs(dirpath)
-        elif os.path.exists(fullpath) and not (opts.force or opts.update):
-            sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
-            sys.exit(1)
+    return os.path.join(package.replace('.', os.sep), document_basename(name) + '.' + suffix)
 
-        # Add to package indexes
-        package_contents.setdefault(package, list()).append(filebasename)
+def package_index_path(package, suffix):
+    return os.path.join(package.replace('.', os.sep), 'package-index.' + suffix)
 
-        if opts.update and os.path.exists(fullpath):
-            # If the destination file is newer than the source file than skip
-            # writing it out
-            source_mod_time = os.stat(sources[fullname]).st_mtime
-            dest_mod_time = os.stat(fullpath).st_mtime
+def write_document(package, name, document, opts):
+    """ Write the document for a single type. Returns the basename of the file
+    for inclusion in the package index.
 
-            if source_mod_time < dest_mod_time:
-                continue
+    """
 
-        f = open(fullpath, 'w')
-        f.write(encode_output(document))
-        f.close()
+    fullpath = os.path.join(opts.destdir, document_path(package, name, opts.suffix))
+    dirpath = os.path.dirname(fullpath)
+
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    elif os.path.exists(fullpath) and not (opts.force or opts.update):
+        sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
+        sys.exit(1)
+
+    write_file(fullpath, document)
 
-    # Write package-index for each package
-    for package, classes in package_contents.items():
+    return document_basename(name)
+
+def write_package_indexes(packages, package_contents, opts):
+    """ Write package-index for each package, listing the given file
+    basenames.
+
+    """
+
+    for package, classes in sorted(package_contents.items()):
         doc = util.Document()
         doc.add_heading(package, '=')
 
@@ -134,15 +272,12 @@ def write_documents(packages, documents, sources, opts):
         toc = util.Directive('toctree')
         toc.add_option('maxdepth', '1')
 
-        classes.sort()
-        for filebasename in classes:
+        for filebasename in sorted(classes):
             toc.add_content(filebasename + '\n')
         doc.add_object(toc)
 
-        package_path = package.replace('.', os.sep)
-        filename = 'package-index.' + opts.suffix
-        dirpath = os.path.join(opts.destdir, package_path)
-        fullpath = os.path.join(dirpath, filename)
+        fullpath = os.path.join(opts.destdir, package_index_path(package, opts.suffix))
+        dirpath = os.path.dirname(fullpath)
 
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
@@ -150,24 +285,331 @@ def write_documents(packages, documents, sources, opts):
             sys.stderr.write(fullpath + ' already exists. Use -f to overwrite.\n')
             sys.exit(1)
 
-        f = open(fullpath, 'w')
-        f.write(encode_output(doc.build()))
-        f.close()
+        write_file(fullpath, doc.build())
+
+def write_documents(packages, documents, sources, opts):
+    package_contents = dict()
+
+    # Write individual documents
+    for fullname, (package, name, document) in documents.items():
+        if is_package_info_doc(name):
+            continue
+
+        filebasename = write_document(package, name, document, opts)
+
+        # Add to package indexes
+        package_contents.setdefault(package, set()).add(filebasename)
+
+    write_package_indexes(packages, package_contents, opts)
+
+def record_documents(new_manifest, source_files, documents, sources, states):
+    """ Record the output of generate_documents in the manifest. """
+
+    by_source = dict((source_file, {}) for source_file in source_files)
+    for fullname, entry in documents.items():
+        by_source[sources[fullname]][fullname] = entry
+
+    for source_file, source_documents in by_source.items():
+        new_manifest.add_source(source_file, states[source_file])
+        new_manifest.add_documents(source_file, source_documents, is_package_info_doc)
+
+def output_paths(output_manifest):
+    """ Return the set of files, relative to the output directory, written for
+    the documents recorded in a manifest.
+
+    """
+
+    packages, package_contents = output_manifest.packages()
+    paths = set()
+
+    for package, names in package_contents.items():
+        paths.add(package_index_path(package, output_manifest.suffix))
+        for name in names:
+            paths.add(document_path(package, name, output_manifest.suffix))
+
+    return paths
+
+def remove_stale_outputs(old_manifest, new_manifest, opts):
+    """ Delete the files generated by a previous run that are no longer
+    generated, e.g. for deleted or renamed types, along with any directories
+    left empty.
+
+    """
+
+    for path in sorted(output_paths(old_manifest) - output_paths(new_manifest)):
+        fullpath = os.path.join(opts.destdir, path)
+
+        if not os.path.exists(fullpath):
+            continue
+
+        if opts.verbose:
+            print('Removing', fullpath)
+
+        os.remove(fullpath)
+
+        dirpath = os.path.dirname(path)
+        while dirpath:
+            try:
+                os.rmdir(os.path.join(opts.destdir, dirpath))
+            except OSError:
+                break
+            dirpath = os.path.dirname(dirpath)
+
+def has_missing_documents(record, opts):
+    """ Check whether any of the documents recorded in the manifest for a source
+    file is missing from the output directory.
+
+    """
+
+    for package, name, _ in record['documents']:
+        if not os.path.exists(os.path.join(opts.destdir, document_path(package, name, opts.suffix))):
+            return True
+
+    return False
+
+def missing_package_indexes(old_manifest, opts):
+    """ Return the set of packages recorded in the manifest whose package index
+    is missing from the output directory.
+
+    """
+
+    _, package_contents = old_manifest.packages()
+
+    return set(package for package in package_contents
+               if not os.path.exists(os.path.join(opts.destdir,
+                                                  package_index_path(package, opts.suffix))))
+
+def update_documents(source_files, old_manifest, new_manifest, doc_cache, opts, doc_compiler=None,
+                     memo=None, member_memo=None):
+    """ Regenerate documents only for the sources which changed since the run
+    that wrote old_manifest. Sources whose size and modification time match the
+    manifest are not read at all; others are compared by their key, so a fresh
+    checkout of unchanged sources doesn't trigger any work. Unchanged sources
+    are regenerated anyway if any of their documents was removed from the
+    output directory. Package indexes are only rewritten for packages affected
+    by changed or removed sources, or whose package index was removed.
+
+    Returns True if any source was changed or removed, or any output restored.
+
+    """
+
+    changed = []
+    current = set()
+
+    for source_file in source_files:
+        try:
+            st = os.stat(source_file)
+        except OSError:
+            # Removed since the source files were listed
+            continue
+
+        current.add(source_file)
+
+        if old_manifest.is_unchanged(source_file, st):
+            new_manifest.copy_source(old_manifest, source_file)
+        else:
+            state = manifest.source_state(source_file, new_manifest.fingerprint)
+            record = old_manifest.sources.get(source_file)
+
+            if record is not None and record['key'] == state['key']:
+                new_manifest.copy_source(old_manifest, source_file, state)
+            else:
+                changed.append(source_file)
+                continue
+
+        if has_missing_documents(new_manifest.sources[source_file], opts):
+            changed.append(source_file)
+            continue
+
+        if doc_cache:
+            doc_cache.mark_used(new_manifest.sources[source_file]['key'])
+
+    removed = [source_file for source_file in old_manifest.sources if source_file not in current]
+
+    affected = missing_package_indexes(old_manifest, opts)
+
+    if not changed and not removed and not affected:
+        return False
+
+    for source_file in changed + removed:
+        affected.update(old_manifest.packages_of(source_file))
+
+    old_digests = old_manifest.digests()
+
+    for source_file, documents, state in iter_generated(changed, doc_cache, opts.member_headers,
+                                                        opts.parser_lib, opts.jobs, doc_compiler, memo,
+                                                        opts.declarations_only, member_memo):
+        if opts.verbose:
+            print('Processing', source_file)
+
+        new_manifest.add_source(source_file, state)
+        new_manifest.add_documents(source_file, documents, is_package_info_doc)
+        affected.update(new_manifest.packages_of(source_file))
+
+        for package, name, digest in new_manifest.sources[source_file]['documents']:
+            fullpath = os.path.join(opts.destdir, document_path(package, name, opts.suffix))
+            if old_digests.get((package, name)) == digest and os.path.exists(fullpath):
+                continue
+
+            write_document(package, name, documents[package + '.' + name][2], opts)
 
-def get_newer(a, b):
-    if not os.path.exists(a):
-        return b
+    packages, package_contents = new_manifest.packages()
+    write_package_indexes(packages, dict((package, set(document_basename(name) for name in names))
+                                         for package, names in package_contents.items()
+                                         if package in affected), opts)
 
-    if not os.path.exists(b):
-        return a
+    return True
 
-    a_mtime = int(os.stat(a).st_mtime)
-    b_mtime = int(os.stat(b).st_mtime)
+def finish_run(old_manifest, new_manifest, packages, opts):
+    """ Remove stale outputs, save the manifest and write the table of
+    contents.
 
-    if a_mtime < b_mtime:
-        return b
+    """
+
+    if old_manifest:
+        remove_stale_outputs(old_manifest, new_manifest, opts)
+
+    write_file(new_manifest.path(opts.destdir), new_manifest.dumps())
+
+    if not opts.notoc:
+        write_toc(packages, opts)
+
+def stat_sources(source_files):
+    state = {}
+
+    for source_file in source_files:
+        try:
+            st = os.stat(source_file)
+        except OSError:
+            continue
+        state[source_file] = (st.st_size, st.st_mtime)
+
+    return state
+
+def watch_sources(discover, current_manifest, doc_cache, opts, memo=None, member_memo=None):
+    """ Poll the sources for changes until interrupted, regenerating the
+    documents for changed sources after each change. The compiler, the cache
+    and the manifest stay in memory between updates.
+
+    """
+
+    doc_compiler = compiler.JavadocRestCompiler(None, opts.member_headers, opts.parser_lib, memo,
+                                                opts.declarations_only, member_memo)
+
+    if not doc_cache:
+        doc_cache = cache.MemoryCache(current_manifest.fingerprint)
+
+    # Everything in the output directory is ours from here on
+    opts.update = True
+
+    print('Watching for changes, press Ctrl+C to stop')
+
+    # Source file stats at the time of the last failed update
+    failed_state = None
+
+    try:
+        while True:
+            time.sleep(opts.watch_interval)
+
+            source_files = discover()
+
+            if failed_state is not None:
+                if stat_sources(source_files) == failed_state:
+                    continue
+                failed_state = None
+
+            new_manifest = manifest.Manifest(current_manifest.fingerprint, current_manifest.suffix)
+
+            try:
+                if not update_documents(source_files, current_manifest, new_manifest, doc_cache, opts,
+                                        doc_compiler):
+                    continue
+            except SystemExit:
+                # The error has been logged; retry once the sources change again
+                failed_state = stat_sources(source_files)
+                continue
+
+            finish_run(current_manifest, new_manifest, new_manifest.packages()[0], opts)
+            current_manifest = new_manifest
+
+            print('Updated documentation at', time.strftime('%H:%M:%S'))
+    except KeyboardInterrupt:
+        pass
+
+class DocumentWriter(threading.Thread):
+    """ Writes documents from a bounded queue on a separate thread, so that
+    writing overlaps with reading and compiling the sources. Only the package
+    metadata needed for the package indexes and the table of contents is
+    retained.
+
+    Errors raised while writing, including the SystemExit raised when a file
+    already exists, are re-raised in the producing thread.
+
+    """
+
+    def __init__(self, opts, new_manifest, maxsize=64):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.opts = opts
+        self.manifest = new_manifest
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+
+        # Package name -> package documentation, and package name -> basenames
+        # of the documents written for it
+        self.packages = {}
+        self.package_contents = {}
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            # Keep draining the queue after an error so the producer can't block
+            if self.error is not None:
+                continue
 
-    return a
+            try:
+                self.write(*item)
+            except BaseException as e:
+                self.error = e
+
+    def write(self, source_file, documents, state):
+        for fullname, (package, name, document) in documents.items():
+            if is_package_info_doc(name):
+                self.packages[package] = document
+                continue
+
+            self.packages.setdefault(package, '')
+            filebasename = write_document(package, name, document, self.opts)
+            self.package_contents.setdefault(package, set()).add(filebasename)
+
+        self.manifest.add_source(source_file, state)
+        self.manifest.add_documents(source_file, documents, is_package_info_doc)
+
+    def put(self, source_file, documents, state):
+        if self.error is not None:
+            raise self.error
+
+        self.queue.put((source_file, documents, state))
+
+    def finish(self):
+        """ Wait for all queued documents to be written and write the package
+        indexes. Returns the packages dict.
+
+        """
+
+        self.queue.put(None)
+        self.join()
+
+        if self.error is not None:
+            raise self.error
+
+        write_package_indexes(self.packages, self.package_contents, self.opts)
+
+        return self.packages
 
 def format_syntax_error(e):
     rest = ""
@@ -177,57 +619,205 @@ def format_syntax_error(e):
         rest = ' at %s line %d, character %d' % (value, pos[0], pos[1])
     return e.description + rest
 
-def generate_from_source_file(doc_compiler, source_file, cache_dir):
-    if cache_dir:
-        fingerprint = hashlib.md5(source_file.encode()).hexdigest()
-        cache_file = os.path.join(cache_dir, 'parsed-' + fingerprint + '.p')
+def generate_from_source_file(doc_compiler, source_file, doc_cache, fingerprint):
+    with stats.file_span(source_file) as file_stats:
+        documents, state = compile_source_file(doc_compiler, source_file, doc_cache, fingerprint)
+        file_stats.count(documents)
 
-        if get_newer(source_file, cache_file) == cache_file:
-            return pickle.load(open(cache_file, 'rb'))
-    else:
-        cache_file = None
+    return documents, state
 
-    f = open(source_file)
-    source = f.read()
-    f.close()
+def compile_source_file(doc_compiler, source_file, doc_cache, fingerprint):
+    """ Generate the documents for a source file. Returns the documents and
+    the state of the source file to record in the manifest, whose key is also
+    the cache key.
 
-    try:
-        ast = javalang.parse.parse(source)
-    except javalang.parser.JavaSyntaxError as e:
-        util.error('Syntax error in %s: %s', source_file, format_syntax_error(e))
-    except Exception:
-        util.unexpected('Unexpected exception while parsing %s', source_file)
+    """
 
-    documents = {}
-    try:
-        if source_file.endswith("package-info.java"):
-            if ast.package is not None:
-                documentation = doc_compiler.compile_docblock(ast.package)
-                documents[ast.package.name] = (ast.package.name, 'package-info', documentation)
+    with stats.span('read', source_file):
+        st = os.stat(source_file)
+        f = open(source_file)
+        source = f.read()
+        f.close()
+
+        cache_key = cache.source_key(fingerprint, source)
+        state = manifest.stat_state(st, cache_key)
+
+    if doc_cache:
+        with stats.span('cache', source_file):
+            documents = doc_cache.get(cache_key)
+
+        if documents is not None:
+            return documents, state
+
+    with stats.span('parse', source_file):
+        try:
+            ast = doc_compiler.parse(source)
+        except javalang.parser.JavaSyntaxError as e:
+            util.error('Syntax error in %s: %s', source_file, format_syntax_error(e))
+        except Exception:
+            util.unexpected('Unexpected exception while parsing %s', source_file)
+
+    with stats.span('compile', source_file):
+        documents = {}
+        try:
+            if source_file.endswith("package-info.java"):
+                if ast.package is not None:
+                    documentation = doc_compiler.compile_docblock(ast.package)
+                    documents[ast.package.name] = (ast.package.name, 'package-info', documentation)
+            else:
+                documents = doc_compiler.compile(ast)
+        except Exception:
+            util.unexpected('Unexpected exception while compiling %s', source_file)
+
+    if doc_cache:
+        with stats.span('cache', source_file):
+            doc_cache.put(cache_key, documents)
+
+    return documents, state
+
+# Compiler, cache, conversion and member memos and options fingerprint used by
+# worker processes when generating documents in parallel. They are set up once
+# per process by init_worker.
+worker_compiler = None
+worker_cache = None
+worker_memo = None
+worker_member_memo = None
+worker_fingerprint = None
+
+def init_worker(member_headers, parser, doc_cache, trace=None, memo=None, declarations_only=False,
+                member_memo=None):
+    global worker_compiler, worker_cache, worker_memo, worker_member_memo, worker_fingerprint
+
+    if memo is not None:
+        worker_memo = memo.for_worker()
+
+    if member_memo is not None:
+        worker_member_memo = member_memo.for_worker()
+
+    worker_compiler = compiler.JavadocRestCompiler(None, member_headers, parser, worker_memo,
+                                                   declarations_only, worker_member_memo)
+    worker_fingerprint = cache.options_fingerprint(member_headers, parser, declarations_only)
+
+    if trace is not None:
+        stats.enable(trace)
+
+    if doc_cache:
+        worker_cache = doc_cache.for_worker()
+
+def generate_in_worker(source_files):
+    """ Process pool entry point, generating documents for a chunk of source
+    files. Errors are reported through util.error and util.unexpected, which
+    exit; the exit status is handed back to the parent since a worker exiting
+    would otherwise leave its task pending forever.
+
+    """
+
+    results = []
+
+    for source_file in source_files:
+        try:
+            documents, state = generate_from_source_file(worker_compiler, source_file, worker_cache,
+                                                         worker_fingerprint)
+        except SystemExit as e:
+            results.append((None, None, None, e.code))
+            break
+
+        if worker_cache:
+            cache_state = worker_cache.take_worker_state()
         else:
-            documents = doc_compiler.compile(ast)
-    except Exception:
-        util.unexpected('Unexpected exception while compiling %s', source_file)
+            cache_state = None
+
+        results.append((documents, state, cache_state, None))
+
+    memo_states = [memo.take_worker_state() if memo is not None else None
+                   for memo in (worker_memo, worker_member_memo)]
+
+    return results, stats.take_worker_state(), memo_states
+
+def iter_generated(source_files, doc_cache, member_headers, parser, jobs=1, doc_compiler=None,
+                   memo=None, declarations_only=False, member_memo=None):
+    """ Generate documents for each source file, yielding (source_file,
+    documents, state) triples in the order of source_files, where state is the
+    state of the source file to record in the manifest.
+
+    With jobs > 1 the files are parsed and compiled by a pool of worker
+    processes. Only a few chunks per worker are in flight at any time, so
+    results can't pile up in memory when the consumer is slower than the
+    workers. If a compiler is given the files are always compiled in this
+    process using it.
+
+    """
+
+    if doc_compiler or jobs <= 1 or len(source_files) <= 1:
+        if not doc_compiler:
+            doc_compiler = compiler.JavadocRestCompiler(None, member_headers, parser, memo,
+                                                        declarations_only, member_memo)
+
+        fingerprint = cache.options_fingerprint(member_headers, parser, declarations_only)
+
+        for source_file in source_files:
+            documents, state = generate_from_source_file(doc_compiler, source_file, doc_cache,
+                                                         fingerprint)
+            yield source_file, documents, state
+        return
+
+    chunksize = max(1, min(64, len(source_files) // (jobs * 4)))
+    chunks = (source_files[i:i + chunksize] for i in range(0, len(source_files), chunksize))
+
+    if stats.recorder:
+        trace = stats.recorder.trace
+    else:
+        trace = None
 
-    if cache_file:
-        dump_file = open(cache_file, 'wb')
-        pickle.dump(documents, dump_file)
-        dump_file.close()
+    pool = multiprocessing.Pool(jobs, init_worker, (member_headers, parser, doc_cache, trace, memo,
+                                                    declarations_only, member_memo))
+    try:
+        pending = collections.deque()
+
+        for chunk in itertools.islice(chunks, jobs * 2):
+            pending.append((chunk, pool.apply_async(generate_in_worker, (chunk,))))
+
+        while pending:
+            chunk, result = pending.popleft()
+            results, stats_state, memo_states = result.get()
+            stats.merge_worker_state(stats_state)
+
+            for parent_memo, memo_state in zip((memo, member_memo), memo_states):
+                if memo_state is not None:
+                    parent_memo.merge_worker_state(memo_state)
+
+            for next_chunk in itertools.islice(chunks, 1):
+                pending.append((next_chunk, pool.apply_async(generate_in_worker, (next_chunk,))))
 
-    return documents
+            for source_file, (documents, state, cache_state, exit_code) in zip(chunk, results):
+                if exit_code is not None:
+                    sys.exit(exit_code)
 
-def generate_documents(source_files, cache_dir, verbose, member_headers, parser):
+                if cache_state:
+                    doc_cache.merge_worker_state(cache_state)
+
+                yield source_file, documents, state
+    finally:
+        pool.terminate()
+        pool.join()
+
+def generate_documents(source_files, doc_cache, verbose, member_headers, parser, jobs=1, memo=None,
+                       declarations_only=False, member_memo=None):
     documents = {}
     sources = {}
-    doc_compiler = compiler.JavadocRestCompiler(None, member_headers, parser)
+    states = {}
 
-    for source_file in source_files:
+    for source_file, this_file_documents, state in iter_generated(source_files, doc_cache,
+                                                                  member_headers, parser, jobs,
+                                                                  memo=memo,
+                                                                  declarations_only=declarations_only,
+                                                                  member_memo=member_memo):
         if verbose:
             print('Processing', source_file)
 
-        this_file_documents = generate_from_source_file(doc_compiler, source_file, cache_dir)
         for fullname in this_file_documents:
             sources[fullname] = source_file
+        states[source_file] = state
 
         documents.update(this_file_documents)
 
@@ -246,25 +836,153 @@ def generate_documents(source_files, cache_dir, verbose, member_headers, parser)
         if is_package_info_doc(name):
             packages[package] = content
 
-    return packages, documents, sources
+    return packages, documents, sources, states
+
+def stream_documents(source_files, doc_cache, new_manifest, opts, memo=None, member_memo=None):
+    """ Generate and write documents one source file at a time. Unlike
+    generate_documents followed by write_documents, memory use doesn't grow
+    with the number of documents. Returns the packages dict.
+
+    """
+
+    writer = DocumentWriter(opts, new_manifest)
+    writer.start()
+
+    for source_file, documents, state in iter_generated(source_files, doc_cache, opts.member_headers,
+                                                        opts.parser_lib, opts.jobs, memo=memo,
+                                                        declarations_only=opts.declarations_only,
+                                                        member_memo=member_memo):
+        if opts.verbose:
+            print('Processing', source_file)
+
+        writer.put(source_file, documents, state)
+
+    return writer.finish()
+
+def maintain_cache(doc_cache, opts):
+    """ Prune, evict and compact the cache as requested by the options. """
+
+    if opts.prune_cache:
+        doc_cache.prune()
+
+    if opts.cache_max_size:
+        doc_cache.evict(opts.cache_max_size)
+
+    if opts.compact_cache:
+        doc_cache.compact()
+
+    if opts.cache_stats:
+        entries, size = doc_cache.size()
+        print(doc_cache.stats.report(entries, size, doc_cache.memo_size()))
+
+def open_memo(memo_class, doc_cache, max_size):
+    """ Create a memo of the given class holding up to max_size bytes, which
+    reads the entries stored with the cache, if any, once it is first used.
+
+    """
+
+    if doc_cache:
+        load = functools.partial(doc_cache.read_memo, memo_class.store_name)
+    else:
+        load = None
+
+    return memo_class(max_size, load)
+
+class Excludes(object):
+    """ Matches paths against the exclude paths given on the command line.
+
+    Plain paths exclude the named file or directory and everything below it.
+    They are stored in a trie of path components, so a directory can be checked
+    by looking up its name in the node of its parent. Paths containing glob
+    wildcards (*, ? or [...]) are matched against complete paths using a single
+    compiled regular expression; * also matches path separators.
+
+    """
+
+    glob_chars_re = re.compile(r'[*?[]')
+
+    def __init__(self, rootpath, excludes):
+        # Nested dicts keyed by path component. An excluded path maps to True.
+        self.trie = {}
+        patterns = []
+
+        for exclude in normalize_excludes(rootpath, excludes):
+            if self.glob_chars_re.search(exclude):
+                patterns.append(fnmatch.translate(exclude))
+            else:
+                self.add(exclude)
+
+        if patterns:
+            self.pattern = re.compile('|'.join('(?:%s)' % (p,) for p in patterns))
+        else:
+            self.pattern = None
+
+    def add(self, path):
+        node = self.trie
+        parts = split_path(path)
+
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if child is True:
+                return
+            node = child
+
+        node[parts[-1]] = True
+
+    def lookup(self, path):
+        """ Return the trie node for the given absolute path, True if the path
+        is excluded by a plain exclude path, or None if no exclude path lies
+        below it.
+
+        """
+
+        node = self.trie
+
+        for part in split_path(path):
+            node = node.get(part)
+            if node is None or node is True:
+                return node
+
+        return node
+
+    def matches_pattern(self, path):
+        return self.pattern is not None and self.pattern.match(path) is not None
+
+    def is_excluded(self, path):
+        """ Check whether the given absolute path or any of its parents are
+        excluded.
+
+        """
+
+        if self.lookup(path) is True:
+            return True
+
+        if self.pattern is not None:
+            while True:
+                if self.pattern.match(path):
+                    return True
+
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                path = parent
+
+        return False
+
+def split_path(path):
+    """ Split an absolute, normalized path into its components. """
+
+    drive, path = os.path.splitdrive(path)
+    return [drive + os.sep] + [part for part in path.split(os.sep) if part]
 
 def normalize_excludes(rootpath, excludes):
     f_excludes = []
     for exclude in excludes:
         if not os.path.isabs(exclude) and not exclude.startswith(rootpath):
             exclude = os.path.join(rootpath, exclude)
-        f_excludes.append(os.path.normpath(exclude) + os.path.sep)
+        f_excludes.append(os.path.normpath(os.path.abspath(exclude)))
     return f_excludes
 
-def is_excluded(root, excludes):
-    sep = os.path.sep
-    if not root.endswith(sep):
-        root += sep
-    for exclude in excludes:
-        if root.startswith(exclude):
-            return True
-    return False
-
 def is_package_info_doc(document_name):
     ''' Checks if the name of a document represents a package-info.java file. '''
     return document_name == 'package-info'
@@ -282,8 +1000,10 @@ for all non-private classes, organized by package under <output_path>. A package
 index (package-index.<ext>) will be created for each package, and a top level
 table of contents will be generated named packages.<ext>.
 
-Paths matching any of the given exclude_paths (interpreted as regular
-expressions) will be skipped.
+Files and directories below any of the given exclude_paths will be skipped.
+Exclude paths containing *, ? or [...] are interpreted as glob patterns matched
+against full paths, where * also matches directory separators. Relative exclude
+paths are interpreted relative to <input_path>.
 
 Note: By default this script will not overwrite already created files.""")
 
@@ -293,6 +1013,18 @@ Note: By default this script will not overwrite already created files.""")
                       help='Overwrite all files')
     parser.add_option('-c', '--cache-dir', action='store', dest='cache_dir',
                       help='Directory to stored cachable output')
+    parser.add_option('--cache-format', action='store', type='choice', dest='cache_format',
+                      choices=sorted(cache.cache_formats), default='files',
+                      help='How cached output is stored: "files" (one file per source) or '
+                           '"pack" (a single pack file and index)')
+    parser.add_option('--compact-cache', action='store_true', dest='compact_cache', default=False,
+                      help='Compact the cache after generating documentation')
+    parser.add_option('--prune-cache', action='store_true', dest='prune_cache', default=False,
+                      help='Remove cache entries not used by the current source files')
+    parser.add_option('--cache-max-size', action='store', dest='cache_max_size',
+                      help='Evict least recently used cache entries beyond this size (e.g. 500M)')
+    parser.add_option('--cache-stats', action='store_true', dest='cache_stats', default=False,
+                      help='Report cache hits, misses and size')
     parser.add_option('-u', '--update', action='store_true', dest='update',
                       help='Overwrite new and changed files', default=False)
     parser.add_option('-T', '--no-toc', action='store_true', dest='notoc',
@@ -305,24 +1037,71 @@ Note: By default this script will not overwrite already created files.""")
                       help='file suffix (default: rst)', default='rst')
     parser.add_option('-I', '--include', action='append', dest='includes',
                       help='Additional input paths to scan', default=[])
+    parser.add_option('--files-from', action='store', dest='files_from',
+                      help='Read the source files to process from this file, one per line, '
+                           'instead of scanning input paths ("-" for standard input)')
     parser.add_option('-p', '--parser', dest='parser_lib', default='lxml',
-                      help='Beautiful Soup---html parser library option.')
+                      help='Beautiful Soup---html parser library option, or "stream" to convert '
+                           'the events of the lxml parser without building a tree.')
+    parser.add_option('--declarations-only', action='store_true', dest='declarations_only',
+                      default=False,
+                      help='Skip the statements in method, constructor and initializer bodies '
+                           'when parsing source files')
+    parser.add_option('--memo-size', action='store', dest='memo_size', default='8M',
+                      help='Total size of the converted HTML fragments and compiled members to '
+                           'remember, split evenly between them, e.g. 500K or 20M (default: 8M, '
+                           '0 to disable)')
+    parser.add_option('-j', '--jobs', action='store', type='int', dest='jobs', default=1,
+                      help='Number of processes used to parse source files (0 for one per CPU)')
+    parser.add_option('--stream', action='store_true', dest='stream', default=False,
+                      help='Write documents as soon as they are generated to bound memory use')
+    parser.add_option('-w', '--watch', action='store_true', dest='watch', default=False,
+                      help='Keep running and regenerate documentation when sources change')
+    parser.add_option('--watch-interval', action='store', type='float', dest='watch_interval',
+                      default=1.0, help='Seconds between checks for changes in watch mode (default: 1)')
+    parser.add_option('--stats', action='store_true', dest='stats', default=False,
+                      help='Report time spent per phase and the slowest source files')
+    parser.add_option('--stats-slowest', action='store', type='int', dest='stats_slowest', default=10,
+                      help='Number of slowest source files to report with --stats (default: 10)')
+    parser.add_option('--trace', action='store', dest='trace',
+                      help='Write a Chrome trace event file with a span per source file and phase')
     parser.add_option('-v', '--verbose', action='store_true', dest='verbose',
                       help='verbose output')
 
     (opts, args) = parser.parse_args(argv[1:])
 
-    if not args:
+    if args:
+        rootpath, excludes = args[0], args[1:]
+    elif opts.files_from:
+        rootpath, excludes = os.curdir, []
+    else:
         parser.error('A source path is required.')
 
-    rootpath, excludes = args[0], args[1:]
-
-    input_paths = opts.includes
-    input_paths.append(rootpath)
+    if opts.files_from:
+        input_paths = []
+    else:
+        input_paths = opts.includes
+        input_paths.append(rootpath)
 
     if not opts.destdir:
         parser.error('An output directory is required.')
 
+    if opts.jobs < 0:
+        parser.error('The number of jobs must not be negative.')
+    elif opts.jobs == 0:
+        opts.jobs = multiprocessing.cpu_count()
+
+    if opts.cache_max_size:
+        try:
+            opts.cache_max_size = cache.parse_size(opts.cache_max_size)
+        except ValueError as e:
+            parser.error(str(e))
+
+    try:
+        opts.memo_size = cache.parse_size(opts.memo_size)
+    except ValueError as e:
+        parser.error(str(e))
+
     if opts.suffix.startswith('.'):
         opts.suffix = opts.suffix[1:]
 
@@ -334,19 +1113,82 @@ Note: By default this script will not overwrite already created files.""")
     if not os.path.isdir(opts.destdir):
         os.makedirs(opts.destdir)
 
-    if opts.cache_dir and not os.path.isdir(opts.cache_dir):
-        os.makedirs(opts.cache_dir)
+    fingerprint = cache.options_fingerprint(opts.member_headers, opts.parser_lib,
+                                            opts.declarations_only)
 
-    excludes = normalize_excludes(rootpath, excludes)
-    source_files = []
+    if opts.stats or opts.trace:
+        stats.enable(trace=bool(opts.trace))
 
-    for input_path in input_paths:
-        source_files.extend(find_source_files(input_path, excludes))
+    start = time.time()
 
-    packages, documents, sources = generate_documents(source_files, opts.cache_dir, opts.verbose,
-                                                      opts.member_headers, opts.parser_lib)
+    if opts.cache_dir:
+        doc_cache = cache.open_cache(opts.cache_dir, opts.cache_format, fingerprint)
+    else:
+        doc_cache = None
+
+    # The stored memos are only read once a source needs to be compiled. They
+    # share the memo size.
+    if opts.memo_size > 0:
+        memo = open_memo(htmlrst.ConversionMemo, doc_cache, opts.memo_size // 2)
+        member_memo = open_memo(compiler.MemberMemo, doc_cache, opts.memo_size - opts.memo_size // 2)
+        memos = [memo, member_memo]
+    else:
+        memo = member_memo = None
+        memos = []
 
-    write_documents(packages, documents, sources, opts)
+    excludes = Excludes(rootpath, excludes)
+    with stats.span('discover'):
+        source_files = discover_sources(input_paths, excludes, opts.files_from)
 
-    if not opts.notoc:
-        write_toc(packages, opts)
+    old_manifest = manifest.Manifest.load(opts.destdir)
+    new_manifest = manifest.Manifest(fingerprint, opts.suffix)
+
+    try:
+        if opts.update and old_manifest and old_manifest.matches(new_manifest):
+            update_documents(source_files, old_manifest, new_manifest, doc_cache, opts, memo=memo,
+                             member_memo=member_memo)
+            packages = new_manifest.packages()[0]
+        elif opts.stream:
+            packages = stream_documents(source_files, doc_cache, new_manifest, opts, memo,
+                                        member_memo)
+        else:
+            packages, documents, sources, states = generate_documents(source_files, doc_cache,
+                                                                      opts.verbose,
+                                                                      opts.member_headers,
+                                                                      opts.parser_lib, opts.jobs,
+                                                                      memo, opts.declarations_only,
+                                                                      member_memo)
+            write_documents(packages, documents, sources, opts)
+            record_documents(new_manifest, source_files, documents, sources, states)
+
+        finish_run(old_manifest, new_manifest, packages, opts)
+
+        if doc_cache:
+            # Saved first so that the memos count towards the size of the cache
+            for m in memos:
+                doc_cache.save_memo(m)
+            maintain_cache(doc_cache, opts)
+
+        if opts.watch:
+            if opts.files_from == '-':
+                # Standard input can't be read again; keep watching the same files
+                discover = lambda: source_files
+            else:
+                # Listed files deleted while watching are dropped like deleted sources
+                discover = lambda: discover_sources(input_paths, excludes, opts.files_from, True)
+
+            watch_sources(discover, new_manifest, doc_cache, opts, memo, member_memo)
+    finally:
+        if doc_cache:
+            for m in memos:
+                doc_cache.save_memo(m)
+            doc_cache.close()
+
+    if opts.stats:
+        print(stats.recorder.report(time.time() - start, opts.stats_slowest,
+                                    doc_cache.stats if doc_cache else None))
+        for m in memos:
+            print(m.report())
+
+    if opts.trace:
+        stats.recorder.write_trace(opts.trace)
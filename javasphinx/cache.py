@@ -0,0 +1,833 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Storage for documents compiled by javasphinx-apidoc.
+
+Two stores are available: DirectoryCache keeps one pickle file per entry, and
+PackCache appends every entry to a single pack file with a separate index of
+offsets that is memory mapped when the cache is opened.
+
+Entries are addressed by the contents of the source file and the options used
+to compile it rather than by its path and modification time, so a cache stays
+valid across checkouts and machines and can never return output produced with
+different options.
+
+"""
+
+try:
+   import cPickle as pickle
+except:
+   import pickle
+
+import binascii
+import hashlib
+import mmap
+import os
+import os.path
+import re
+import struct
+import tempfile
+
+import bs4
+import javalang
+import lxml.etree
+
+import javasphinx
+import javasphinx.stats as stats
+
+def to_bytes(s):
+    if isinstance(s, bytes):
+        return s
+    else:
+        return s.encode('utf-8')
+
+def options_fingerprint(member_headers, parser, declarations_only=False):
+    """ Describe everything besides the source text that affects the compiled
+    documents.
+
+    """
+
+    fingerprint = 'javasphinx=%s;javalang=%s;member_headers=%s;parser=%s;' % (
+        javasphinx.__version__, getattr(javalang, '__version__', ''), member_headers, parser)
+
+    # Sources with syntax errors in a method body compile in declarations only
+    # mode. Left out otherwise so existing caches stay valid.
+    if declarations_only:
+        fingerprint += 'declarations_only=True;'
+
+    return fingerprint
+
+def memo_fingerprint():
+    """ Describe everything besides the parser and the HTML that affects the
+    fragments held by a conversion memo and the directives held by a member
+    memo.
+
+    """
+
+    # Format 2 keeps fragments and directives apart, format 1 held both in the
+    # conversion memo
+    return 'format=2;javasphinx=%s;javalang=%s;beautifulsoup4=%s;lxml=%s;' % (
+        javasphinx.__version__, getattr(javalang, '__version__', ''), bs4.__version__,
+        lxml.etree.__version__)
+
+def source_key(fingerprint, source):
+    """ Compute the cache key for the given source text. """
+
+    h = hashlib.sha1(to_bytes(fingerprint))
+    h.update(to_bytes(source))
+    return h.hexdigest()
+
+def parse_size(s):
+    """ Parse a size such as 500000, 200K, 50M or 2G into a number of bytes. """
+
+    m = re.match(r'^\s*(\d+)\s*([kmgt]?)b?\s*$', s, re.IGNORECASE)
+    if not m:
+        raise ValueError('invalid size ' + s)
+
+    number, unit = m.groups()
+    return int(number) * 1024 ** ' kmgt'.index(unit.lower() or ' ')
+
+def format_size(n):
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB'):
+        if n < 1024 or unit == 'GiB':
+            break
+        n = n / 1024.0
+
+    if unit == 'bytes':
+        return '%d %s' % (n, unit)
+    else:
+        return '%.1f %s' % (n, unit)
+
+def open_temporary(dirpath):
+    """ Create a temporary file in dirpath that can later be renamed into
+    place. Returns the open file and its path.
+
+    """
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=dirpath)
+
+    # mkstemp creates files readable only by the owner; use the permissions a
+    # regularly created file would get instead
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(tmp_path, 0o666 & ~umask)
+
+    return os.fdopen(fd, 'wb'), tmp_path
+
+class CacheStats(object):
+    """ Counters describing how a cache was used during a run. """
+
+    fields = ('hits', 'misses', 'bytes_read', 'bytes_written', 'evicted', 'bytes_evicted')
+
+    def __init__(self):
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    def merge(self, other):
+        for field in self.fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def report(self, entries, size, memo_size=0):
+        return '\n'.join([
+            stats.format_hits('Cache', self.hits, self.misses),
+            'Cache bytes read: %s, written: %s' % (format_size(self.bytes_read), format_size(self.bytes_written)),
+            'Cache entries evicted: %d (%s)' % (self.evicted, format_size(self.bytes_evicted)),
+            'Cache size: %d entries, %s (memos: %s)' % (entries, format_size(size),
+                                                       format_size(memo_size))])
+
+class Cache(object):
+    """ Base class for document caches. Entries map a key, computed from the
+    source text, to the documents compiled from it.
+
+    Every key looked up or stored during a run is remembered, so that prune()
+    can drop entries for sources that are gone and evict() can prefer to keep
+    entries that are in use.
+
+    The conversion memo and the member memo of a run can be stored alongside
+    the entries, each in its own file, so HTML fragments converted and members
+    compiled in earlier runs needn't be converted or compiled again when a
+    source file changes. Together they count as a single unit towards the size
+    of the cache.
+
+    """
+
+    # Files of the conversion memo and the member memo
+    memo_names = ('convert-memo.p', 'member-memo.p')
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+
+        self.stats = CacheStats()
+        self.used = set()
+
+    def key(self, source):
+        """ Compute the key for the given source text. """
+        return source_key(self.fingerprint, source)
+
+    def mark_used(self, key):
+        """ Note that the entry for key is still needed, without reading it. """
+        self.used.add(key)
+
+    def get(self, key):
+        """ Return the documents stored under key, or None if there are none. """
+
+        self.used.add(key)
+
+        data = self.get_data(key)
+        documents = None
+
+        if data is not None:
+            try:
+                documents = pickle.loads(data)
+            except Exception:
+                # A corrupt or truncated entry is treated as a miss and rewritten
+                pass
+
+        if documents is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self.stats.bytes_read += len(data)
+
+        return documents
+
+    def put(self, key, documents):
+        data = pickle.dumps(documents, pickle.HIGHEST_PROTOCOL)
+
+        self.used.add(key)
+        self.stats.bytes_written += len(data)
+        self.put_data(key, data)
+
+    def get_data(self, key):
+        """ Return the pickled entry stored under key, or None. """
+        raise NotImplementedError
+
+    def put_data(self, key, data):
+        """ Store an already pickled entry. """
+        raise NotImplementedError
+
+    def for_worker(self):
+        """ Return the cache to be used by a worker process. """
+        return self
+
+    def take_worker_state(self):
+        """ Return and reset everything a worker process recorded that the
+        parent process needs to know about.
+
+        """
+
+        state = (self.take_pending(), self.stats, self.used)
+
+        self.stats = CacheStats()
+        self.used = set()
+
+        return state
+
+    def merge_worker_state(self, state):
+        pending, stats, used = state
+
+        for key, data in pending:
+            self.put_data(key, data)
+
+        self.stats.merge(stats)
+        self.used.update(used)
+
+    def take_pending(self):
+        """ Return and forget the entries written by a worker process that must
+        be stored by the parent process.
+
+        """
+
+        return []
+
+    def size(self):
+        """ Return the number of entries and the bytes occupied by them and
+        the conversion memo.
+
+        """
+
+        raise NotImplementedError
+
+    def prune(self):
+        """ Remove all entries which weren't used during this run. """
+        raise NotImplementedError
+
+    def evict(self, max_size):
+        """ Remove least recently used entries until the cache occupies at most
+        max_size bytes. The memos are removed after the entries not used during
+        this run but before any that were.
+
+        """
+
+        raise NotImplementedError
+
+    def compact(self):
+        """ Reclaim space used by superseded entries. """
+        pass
+
+    def memo_path(self, name):
+        return os.path.join(self.path, name)
+
+    def memo_size(self):
+        """ Return the bytes occupied by the stored memos. """
+
+        if self.path is None:
+            return 0
+
+        size = 0
+
+        for name in self.memo_names:
+            try:
+                size += os.path.getsize(self.memo_path(name))
+            except OSError:
+                pass
+
+        return size
+
+    def read_memo(self, name):
+        """ Return the (key, reST) pairs of the memo stored with the cache in
+        the given file, least recently used first.
+
+        """
+
+        if self.path is None:
+            return []
+
+        try:
+            f = open(self.memo_path(name), 'rb')
+        except IOError:
+            return []
+
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        try:
+            fingerprint, entries = pickle.loads(data)
+        except Exception:
+            # A corrupt memo is ignored and replaced when the memo is saved
+            return []
+
+        if fingerprint != memo_fingerprint():
+            return []
+
+        self.stats.bytes_read += len(data)
+        return entries
+
+    def save_memo(self, memo):
+        """ Store the entries held by memo with the cache, replacing the
+        previously stored ones. Nothing is written unless entries were added to
+        the memo since it was loaded or last saved.
+
+        """
+
+        if self.path is None or memo.max_size <= 0 or not memo.changed:
+            return
+
+        memo.ensure_loaded()
+        data = pickle.dumps((memo_fingerprint(), memo.items()), pickle.HIGHEST_PROTOCOL)
+
+        f, tmp_path = open_temporary(self.path)
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+        os.rename(tmp_path, self.memo_path(memo.store_name))
+
+        self.stats.bytes_written += len(data)
+        memo.changed = False
+
+    def remove_memo(self):
+        """ Remove the stored memos. """
+
+        for name in self.memo_names:
+            path = self.memo_path(name)
+
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+
+            self.stats.evicted += 1
+            self.stats.bytes_evicted += size
+
+    def close(self):
+        pass
+
+class MemoryCache(Cache):
+    """ Keeps entries in memory for the lifetime of the process. """
+
+    def __init__(self, fingerprint):
+        Cache.__init__(self, None, fingerprint)
+        self.entries = {}
+
+    def get_data(self, key):
+        return self.entries.get(key)
+
+    def put_data(self, key, data):
+        self.entries[key] = data
+
+    def size(self):
+        return len(self.entries), sum(len(data) for data in self.entries.values())
+
+    def prune(self):
+        for key in list(self.entries):
+            if key not in self.used:
+                self.stats.evicted += 1
+                self.stats.bytes_evicted += len(self.entries.pop(key))
+
+    def evict(self, max_size):
+        total = self.size()[1]
+
+        # Entries are kept in insertion order, so the oldest go first
+        for key in [key for key in self.entries if key not in self.used] + list(self.used):
+            if total <= max_size:
+                break
+
+            data = self.entries.pop(key, None)
+            if data is not None:
+                total -= len(data)
+                self.stats.evicted += 1
+                self.stats.bytes_evicted += len(data)
+
+class DirectoryCache(Cache):
+    """ Stores each entry as a separate pickle file within a directory. Entries
+    are written through a temporary file and renamed into place, so several
+    processes may write to the same directory.
+
+    Recency is tracked through the modification times of the entry files.
+
+    Files named after the md5 of a source path, as written by javasphinx before
+    entries were addressed by content, are listed as entries too. They are
+    never used, so pruning and eviction remove them first.
+
+    """
+
+    entry_re = re.compile(r'^parsed-([0-9a-f]{40}|[0-9a-f]{32})\.p$')
+
+    def entry_path(self, key):
+        return os.path.join(self.path, 'parsed-' + key + '.p')
+
+    def get_data(self, key):
+        try:
+            f = open(self.entry_path(key), 'rb')
+        except IOError:
+            return None
+
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def put_data(self, key, data):
+        f, tmp_path = open_temporary(self.path)
+        try:
+            f.write(data)
+        finally:
+            f.close()
+
+        try:
+            os.rename(tmp_path, self.entry_path(key))
+        except OSError:
+            os.remove(tmp_path)
+
+    def entries(self):
+        """ Return (key, path, size, mtime) for each entry in the directory. """
+
+        entries = []
+
+        for filename in os.listdir(self.path):
+            m = self.entry_re.match(filename)
+            if not m:
+                continue
+
+            path = os.path.join(self.path, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((m.group(1), path, st.st_size, st.st_mtime))
+
+        return entries
+
+    def remove_entry(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+
+        self.stats.evicted += 1
+        self.stats.bytes_evicted += size
+
+    def size(self):
+        entries = self.entries()
+        return len(entries), sum(size for _, _, size, _ in entries) + self.memo_size()
+
+    def prune(self):
+        for key, path, size, _ in self.entries():
+            if key not in self.used:
+                self.remove_entry(path, size)
+
+    def evict(self, max_size):
+        entries = []
+
+        for key, path, size, mtime in self.entries():
+            if key in self.used:
+                # Mark the entry as recently used for future runs
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    pass
+            entries.append((key in self.used, mtime, path, size))
+
+        entries.sort()
+
+        memo_size = self.memo_size()
+        total = sum(size for _, _, _, size in entries) + memo_size
+
+        for used, _, path, size in entries:
+            if total <= max_size:
+                break
+
+            if used and memo_size:
+                self.remove_memo()
+                total -= memo_size
+                memo_size = 0
+                if total <= max_size:
+                    break
+
+            self.remove_entry(path, size)
+            total -= size
+
+        if total > max_size and memo_size:
+            self.remove_memo()
+
+class PackCache(Cache):
+    """ Stores all entries in a single append-only pack file.
+
+    The index file holds a fixed size record (key digest, offset, length) for
+    every entry appended to the pack. Later records for a key supersede earlier
+    ones. A truncated trailing record, e.g. left by an interrupted run, is
+    ignored.
+
+    Rewriting the pack (compact, prune and evict) moves the entries used during
+    the run to the end, so the order of entries in the pack is also their least
+    recently used order.
+
+    Only the process that opened the cache appends to it. The copies returned
+    by for_worker() read from the pack and queue their writes, which the parent
+    collects through take_worker_state() and stores.
+
+    """
+
+    pack_name = 'cache.pack'
+    index_name = 'cache.idx'
+    index_magic = b'JSPKIDX1'
+    index_record = struct.Struct('>20sQI')
+
+    def __init__(self, path, fingerprint):
+        Cache.__init__(self, path, fingerprint)
+
+        self.pack_path = os.path.join(path, self.pack_name)
+        self.index_path = os.path.join(path, self.index_name)
+
+        self.is_worker = False
+        self.pending = []
+
+        self._index = None
+        self._pack = None
+        self._pack_map = None
+        self._append_pack = None
+        self._append_index = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'fingerprint': self.fingerprint, 'is_worker': self.is_worker}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['fingerprint'])
+        self.is_worker = state['is_worker']
+
+    def for_worker(self):
+        worker_cache = PackCache(self.path, self.fingerprint)
+        worker_cache.is_worker = True
+        return worker_cache
+
+    # --------------------------------------------------------------------------
+    # ---- Reading ----
+
+    def _load_index(self):
+        index = {}
+
+        try:
+            f = open(self.index_path, 'rb')
+        except IOError:
+            return index
+
+        try:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(self.index_magic):
+                return index
+
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if buf[:len(self.index_magic)] != self.index_magic:
+                    return index
+
+                record_size = self.index_record.size
+                end = len(self.index_magic) + ((size - len(self.index_magic)) // record_size) * record_size
+
+                for offset in range(len(self.index_magic), end, record_size):
+                    digest, pack_offset, length = self.index_record.unpack_from(buf, offset)
+                    index[digest] = (pack_offset, length)
+            finally:
+                buf.close()
+        finally:
+            f.close()
+
+        return index
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _map_pack(self, end):
+        """ Make sure the pack mapping covers the given end offset. """
+
+        if self._pack_map is not None and len(self._pack_map) >= end:
+            return True
+
+        if self._pack_map is not None:
+            self._pack_map.close()
+            self._pack_map = None
+
+        if self._pack is None:
+            try:
+                self._pack = open(self.pack_path, 'rb')
+            except IOError:
+                return False
+
+        size = os.fstat(self._pack.fileno()).st_size
+        if size == 0 or size < end:
+            return False
+
+        self._pack_map = mmap.mmap(self._pack.fileno(), 0, access=mmap.ACCESS_READ)
+        return True
+
+    def get_data(self, key):
+        entry = self.index.get(binascii.unhexlify(key))
+        if entry is None:
+            return None
+
+        offset, length = entry
+
+        if self._append_pack is not None:
+            self._append_pack.flush()
+
+        if not self._map_pack(offset + length):
+            return None
+
+        return self._pack_map[offset:offset + length]
+
+    # --------------------------------------------------------------------------
+    # ---- Writing ----
+
+    def _open_for_append(self):
+        if self._append_pack is not None:
+            return
+
+        self._append_pack = open(self.pack_path, 'ab')
+        self._append_index = open(self.index_path, 'ab')
+
+        # Drop a partially written trailing record so that new records stay
+        # aligned, and start over if the index isn't one we understand
+        size = self._append_index.tell()
+        header_size = len(self.index_magic)
+        aligned = header_size + ((size - header_size) // self.index_record.size) * self.index_record.size
+
+        if size < header_size or not self.index:
+            self._append_index.truncate(0)
+            self._append_index.write(self.index_magic)
+        elif aligned != size:
+            self._append_index.truncate(aligned)
+
+    def put(self, key, documents):
+        if self.is_worker:
+            data = pickle.dumps(documents, pickle.HIGHEST_PROTOCOL)
+
+            self.used.add(key)
+            self.stats.bytes_written += len(data)
+            self.pending.append((key, data))
+        else:
+            Cache.put(self, key, documents)
+
+    def put_data(self, key, data):
+        self._open_for_append()
+
+        digest = binascii.unhexlify(key)
+        offset = self._append_pack.tell()
+
+        self._append_pack.write(data)
+        self._append_index.write(self.index_record.pack(digest, offset, len(data)))
+
+        self.index[digest] = (offset, len(data))
+
+    def take_pending(self):
+        pending, self.pending = self.pending, []
+        return pending
+
+    # --------------------------------------------------------------------------
+    # ---- Maintenance ----
+
+    def _lru_entries(self):
+        """ Return (digest, offset, length) for each live entry, least recently
+        used first.
+
+        """
+
+        used = set(binascii.unhexlify(key) for key in self.used)
+        entries = [(digest in used, offset, digest, length)
+                   for digest, (offset, length) in self.index.items()]
+        entries.sort()
+
+        return [(digest, offset, length) for _, offset, digest, length in entries]
+
+    def _rewrite(self, entries):
+        """ Replace the pack and index with ones holding only the given entries,
+        in the given order.
+
+        """
+
+        self.close()
+
+        pack_out, pack_tmp = open_temporary(self.path)
+        index_out, index_tmp = open_temporary(self.path)
+        index = {}
+
+        try:
+            index_out.write(self.index_magic)
+
+            if entries and self._map_pack(0):
+                for digest, offset, length in entries:
+                    if offset + length > len(self._pack_map):
+                        continue
+
+                    new_offset = pack_out.tell()
+                    pack_out.write(self._pack_map[offset:offset + length])
+                    index_out.write(self.index_record.pack(digest, new_offset, length))
+                    index[digest] = (new_offset, length)
+        finally:
+            pack_out.close()
+            index_out.close()
+            self.close()
+
+        os.rename(pack_tmp, self.pack_path)
+        os.rename(index_tmp, self.index_path)
+
+        self._index = index
+
+    def _drop(self, entries, keep):
+        for digest, offset, length in entries:
+            if not keep(digest):
+                self.stats.evicted += 1
+                self.stats.bytes_evicted += length
+
+    def size(self):
+        if self._append_pack is not None:
+            self._append_pack.flush()
+            self._append_index.flush()
+
+        total = 0
+
+        for path in (self.pack_path, self.index_path):
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+
+        return len(self.index), total + self.memo_size()
+
+    def compact(self):
+        self._rewrite(self._lru_entries())
+
+    def prune(self):
+        used = set(binascii.unhexlify(key) for key in self.used)
+        entries = self._lru_entries()
+
+        self._drop(entries, lambda digest: digest in used)
+        self._rewrite([e for e in entries if e[0] in used])
+
+    def evict(self, max_size):
+        entries = self._lru_entries()
+        used = set(binascii.unhexlify(key) for key in self.used)
+
+        memo_size = self.memo_size()
+        total = len(self.index_magic) + sum(self.index_record.size + length for _, _, length in entries)
+        total += memo_size
+
+        start = 0
+        while start < len(entries) and total > max_size:
+            if entries[start][0] in used and memo_size:
+                self.remove_memo()
+                total -= memo_size
+                memo_size = 0
+                continue
+
+            total -= self.index_record.size + entries[start][2]
+            start += 1
+
+        if total > max_size and memo_size:
+            self.remove_memo()
+
+        if start == 0 and self.size()[1] <= max_size:
+            return
+
+        evicted = set(digest for digest, _, _ in entries[:start])
+        self._drop(entries, lambda digest: digest not in evicted)
+        self._rewrite(entries[start:])
+
+    def close(self):
+        if self._append_pack is not None:
+            self._append_pack.close()
+            self._append_index.close()
+            self._append_pack = None
+            self._append_index = None
+
+        if self._pack_map is not None:
+            self._pack_map.close()
+            self._pack_map = None
+
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+cache_formats = {
+    'files': DirectoryCache,
+    'pack': PackCache
+}
+
+def open_cache(path, cache_format, fingerprint):
+    """ Open the cache stored at path, creating the directory if necessary. """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    return cache_formats[cache_format](path, fingerprint)
@@ -14,25 +14,121 @@
 # limitations under the License.
 #
 
+import collections
+
 import javalang
 
+import javasphinx.declarations as declarations
 import javasphinx.formatter as formatter
 import javasphinx.util as util
 import javasphinx.htmlrst as htmlrst
 
+# A type or member documented in a type's document. section is the heading
+# members are listed under, None for the type itself.
+Member = collections.namedtuple('Member', ['section', 'name', 'directive_type', 'signature', 'node',
+                                           'outertype'])
+
+class MemberMemo(htmlrst.ConversionMemo):
+    """ Least recently used memo of the directives built for types and members,
+    keyed on everything a directive is built from. It is stored in the cache
+    directory apart from the conversion memo, so unchanged members of a changed
+    source file aren't compiled again by later runs.
+
+    """
+
+    store_name = 'member-memo.p'
+    label = 'Member memo'
+
 class JavadocRestCompiler(object):
     """ Javadoc to ReST compiler. Builds ReST documentation from a Java syntax
     tree. """
 
-    def __init__(self, filter=None, member_headers=True, parser='lxml'):
+    def __init__(self, filter=None, member_headers=True, parser='lxml', memo=None,
+                 declarations_only=False, member_memo=None):
         if filter:
             self.filter = filter
         else:
             self.filter = self.__default_filter
 
-        self.converter = htmlrst.Converter(parser)
+        self.parser = parser
+        self.converter = htmlrst.Converter(parser, memo)
+
+        # Directives compiled for members are remembered in a MemberMemo, so
+        # unchanged members of a changed source file aren't compiled again
+        self.member_memo = member_memo
 
         self.member_headers = member_headers
+        self.declarations_only = declarations_only
+
+        # Parsed docblocks by node id, as (node, parsed docblock). The node is
+        # kept alive so its id can not be reused while the entry exists.
+        self.docblocks = {}
+
+        # reST for HTML fragments converted ahead of time by convert_docblocks()
+        self.converted = {}
+
+        # Directives found in the memo by compile(), by node id, as (node,
+        # built directive)
+        self.rendered = {}
+
+    def parse(self, source):
+        """ Parse Java source into a syntax tree for compile(). In declarations
+        only mode the statements in method, constructor and initializer bodies
+        are skipped.
+
+        """
+
+        if self.declarations_only:
+            return declarations.parse(source)
+        return javalang.parse.parse(source)
+
+    def parse_docblock(self, documented):
+        """ Return the parsed Javadoc comment of the given node, or None if it has
+        none. Each node's comment is only parsed once, so filters may call this
+        without the documentation being parsed again when it is output.
+
+        """
+
+        if not documented.documentation:
+            return None
+
+        entry = self.docblocks.get(id(documented))
+        if entry is not None and entry[0] is documented:
+            return entry[1]
+
+        doc = javalang.javadoc.parse(documented.documentation)
+        self.docblocks[id(documented)] = (documented, doc)
+
+        return doc
+
+    def convert_docblocks(self, nodes):
+        """ Convert the HTML in the docblocks of the given nodes to reST in a
+        single batch. The converted fragments are used when the nodes are
+        compiled.
+
+        """
+
+        fragments = []
+        seen = set()
+        for node in nodes:
+            doc = self.parse_docblock(node)
+            if doc is None:
+                continue
+
+            # Repeated fragments, e.g. on overloads, are only converted once
+            for fragment in self.__doc_fragments(doc):
+                if fragment not in seen:
+                    seen.add(fragment)
+                    fragments.append(fragment)
+
+        self.converted.update(zip(fragments, self.converter.convert_many(fragments)))
+
+    def clear_docblocks(self):
+        """ Forget all parsed docblocks and converted fragments. """
+
+        self.docblocks.clear()
+        self.converted.clear()
+        self.rendered.clear()
 
     def __default_filter(self, node):
         """Excludes private members and those tagged "@hide" / "@exclude" in their
@@ -47,14 +143,46 @@ class JavadocRestCompiler(object):
             return False
 
         if isinstance(node, javalang.tree.Documented) and node.documentation:
-            doc = javalang.javadoc.parse(node.documentation)
+            # Only parse the docblock if it may contain one of the tags
+            if '@hide' not in node.documentation and '@exclude' not in node.documentation:
+                return True
+
+            doc = self.parse_docblock(node)
             if 'hide' in doc.tags or 'exclude' in doc.tags:
                 return False
 
         return True
 
     def __html_to_rst(self, s):
-        return self.converter.convert(s)
+        rst = self.converted.get(s)
+        if rst is None:
+            rst = self.converter.convert(s)
+        return rst
+
+    def __doc_fragments(self, doc):
+        """ Yield the HTML fragments of a parsed docblock which __output_doc
+        converts to reST.
+
+        """
+
+        if doc.description:
+            yield doc.description
+
+        if doc.authors:
+            yield ', '.join(doc.authors)
+
+        for name, value in doc.params:
+            yield value
+
+        for exception in doc.throws:
+            yield doc.throws[exception]
+
+        if doc.return_doc:
+            yield doc.return_doc
+
+        for see in doc.tags.get('see', []):
+            if see.startswith('<a href'):
+                yield see
 
     def __output_doc(self, documented):
         if not isinstance(documented, javalang.tree.Documented):
@@ -62,11 +190,10 @@ class JavadocRestCompiler(object):
 
         output = util.Document()
 
-        if not documented.documentation:
+        doc = self.parse_docblock(documented)
+        if doc is None:
             return output
 
-        doc = javalang.javadoc.parse(documented.documentation)
-
         if doc.description:
             output.add(self.__html_to_rst(doc.description))
             output.clear()
@@ -105,18 +232,13 @@ class JavadocRestCompiler(object):
             # Type reference (default)
             return ':java:ref:`%s`' % (see.replace('#', '.').replace(' ', ''),)
 
-    def compile_type(self, declaration):
+    def type_signature(self, declaration):
         signature = util.StringBuilder()
         formatter.output_declaration(declaration, signature)
 
-        doc = self.__output_doc(declaration)
+        return signature.build()
 
-        directive = util.Directive('java:type', signature.build())
-        directive.add_content(doc)
-
-        return directive
-
-    def compile_enum_constant(self, enum, constant):
+    def enum_constant_signature(self, enum, constant):
         signature = util.StringBuilder()
 
         for annotation in constant.annotations:
@@ -128,14 +250,9 @@ class JavadocRestCompiler(object):
         signature.append(' ')
         signature.append(constant.name)
 
-        doc = self.__output_doc(constant)
+        return signature.build()
 
-        directive = util.Directive('java:field', signature.build())
-        directive.add_content(doc)
-
-        return directive
-
-    def compile_field(self, field):
+    def field_signature(self, field):
         signature = util.StringBuilder()
 
         for annotation in field.annotations:
@@ -148,14 +265,9 @@ class JavadocRestCompiler(object):
         signature.append(' ')
         signature.append(field.declarators[0].name)
 
-        doc = self.__output_doc(field)
-
-        directive = util.Directive('java:field', signature.build())
-        directive.add_content(doc)
-
-        return directive
+        return signature.build()
 
-    def compile_constructor(self, constructor):
+    def constructor_signature(self, constructor):
         signature = util.StringBuilder()
 
         for annotation in constructor.annotations:
@@ -178,14 +290,9 @@ class JavadocRestCompiler(object):
             signature.append(' throws ')
             formatter.output_list(formatter.output_exception, constructor.throws, signature, ', ')
 
-        doc = self.__output_doc(constructor)
-
-        directive = util.Directive('java:constructor', signature.build())
-        directive.add_content(doc)
-
-        return directive
+        return signature.build()
 
-    def compile_method(self, method):
+    def method_signature(self, method):
         signature = util.StringBuilder()
 
         for annotation in method.annotations:
@@ -211,17 +318,121 @@ class JavadocRestCompiler(object):
             signature.append(' throws ')
             formatter.output_list(formatter.output_exception, method.throws, signature, ', ')
 
-        doc = self.__output_doc(method)
+        return signature.build()
 
-        directive = util.Directive('java:method', signature.build())
-        directive.add_content(doc)
+    def __compile_directive(self, directive_type, signature, documented):
+        directive = util.Directive(directive_type, signature)
+        directive.add_content(self.__output_doc(documented))
 
         return directive
 
-    def compile_type_document(self, imports_block, package, name, declaration):
+    def compile_type(self, declaration):
+        return self.__compile_directive('java:type', self.type_signature(declaration), declaration)
+
+    def compile_enum_constant(self, enum, constant):
+        return self.__compile_directive('java:field', self.enum_constant_signature(enum, constant),
+                                        constant)
+
+    def compile_field(self, field):
+        return self.__compile_directive('java:field', self.field_signature(field), field)
+
+    def compile_constructor(self, constructor):
+        return self.__compile_directive('java:constructor', self.constructor_signature(constructor),
+                                        constructor)
+
+    def compile_method(self, method):
+        return self.__compile_directive('java:method', self.method_signature(method), method)
+
+    def members(self, name, declaration):
+        """ Return the type declaration and the members documented along with it
+        as Member tuples, in the order they are documented.
+
+        """
+
+        members = [Member(None, name, 'java:type', self.type_signature(declaration), declaration,
+                          name.rpartition('.')[0])]
+
+        if isinstance(declaration, javalang.tree.EnumDeclaration):
+            enum_constants = list(declaration.body.constants)
+            enum_constants.sort(key=lambda c: c.name)
+            for enum_constant in enum_constants:
+                members.append(Member('Enum Constants', enum_constant.name, 'java:field',
+                                      self.enum_constant_signature(name, enum_constant),
+                                      enum_constant, name))
+
+        fields = list(filter(self.filter, declaration.fields))
+        fields.sort(key=lambda f: f.declarators[0].name)
+        for field in fields:
+            members.append(Member('Fields', field.declarators[0].name, 'java:field',
+                                  self.field_signature(field), field, name))
+
+        constructors = list(filter(self.filter, declaration.constructors))
+        constructors.sort(key=lambda c: c.name)
+        for constructor in constructors:
+            members.append(Member('Constructors', constructor.name, 'java:constructor',
+                                  self.constructor_signature(constructor), constructor, name))
+
+        methods = list(filter(self.filter, declaration.methods))
+        methods.sort(key=lambda m: m.name)
+        for method in methods:
+            members.append(Member('Methods', method.name, 'java:method',
+                                  self.method_signature(method), method, name))
+
+        return members
+
+    def __member_key(self, member):
+        """ Memo key for the directive of a member, made up of everything the
+        directive is built from.
+
+        """
+
+        return ('member', self.parser, member.directive_type, member.signature,
+                member.node.documentation, member.outertype)
+
+    def __lookup_member(self, member):
+        """ Return the directive built for an identical member from the memo,
+        or None. The result is remembered for compile_member().
+
+        """
+
+        rst = None
+        if self.member_memo is not None:
+            rst = self.member_memo.get(self.__member_key(member))
+
+        self.rendered[id(member.node)] = (member.node, rst)
+
+        return rst
+
+    def compile_member(self, member):
+        """ Return the built directive documenting a type or member. Directives
+        built for identical members are reused while they are in the memo.
+
+        """
+
+        entry = self.rendered.get(id(member.node))
+        if entry is not None and entry[0] is member.node:
+            rst = entry[1]
+        else:
+            rst = self.__lookup_member(member)
+
+        if rst is not None:
+            return rst
+
+        directive = self.__compile_directive(member.directive_type, member.signature, member.node)
+        if member.outertype:
+            directive.add_option('outertype', member.outertype)
+        rst = directive.build()
+
+        if self.member_memo is not None:
+            self.member_memo.put(self.__member_key(member), rst)
+
+        return rst
+
+    def compile_type_document(self, imports_block, package, name, declaration, members=None):
         """ Compile a complete document, documenting a type and its members """
 
-        outer_type = name.rpartition('.')[0]
+        if members is None:
+            members = self.members(name, declaration)
 
         document = util.Document()
         document.add(imports_block)
@@ -234,56 +445,27 @@ class JavadocRestCompiler(object):
         package_dir.add_option('noindex')
         document.add_object(package_dir)
 
-        # Add type-level documentation
-        type_dir = self.compile_type(declaration)
-        if outer_type:
-            type_dir.add_option('outertype', outer_type)
-        document.add_object(type_dir)
-
+        # Enums get a section for their constants even if they have none
+        section = None
         if isinstance(declaration, javalang.tree.EnumDeclaration):
-            enum_constants = list(declaration.body.constants)
-            enum_constants.sort(key=lambda c: c.name)
+            section = 'Enum Constants'
 
-            document.add_heading('Enum Constants')
-            for enum_constant in enum_constants:
-                if self.member_headers:
-                    document.add_heading(enum_constant.name, '^')
-                c = self.compile_enum_constant(name, enum_constant)
-                c.add_option('outertype', name)
-                document.add_object(c)
+        for i, member in enumerate(members):
+            if i and member.section != section:
+                section = member.section
+                document.add_heading(section, '-')
 
-        fields = list(filter(self.filter, declaration.fields))
-        if fields:
-            document.add_heading('Fields', '-')
-            fields.sort(key=lambda f: f.declarators[0].name)
-            for field in fields:
-                if self.member_headers:
-                    document.add_heading(field.declarators[0].name, '^')
-                f = self.compile_field(field)
-                f.add_option('outertype', name)
-                document.add_object(f)
+            if i and self.member_headers:
+                document.add_heading(member.name, '^')
 
-        constructors = list(filter(self.filter, declaration.constructors))
-        if constructors:
-            document.add_heading('Constructors', '-')
-            constructors.sort(key=lambda c: c.name)
-            for constructor in constructors:
-                if self.member_headers:
-                    document.add_heading(constructor.name, '^')
-                c = self.compile_constructor(constructor)
-                c.add_option('outertype', name)
-                document.add_object(c)
+            # Built directives are separated from their surroundings just like
+            # a Directive added as an object
+            document.clear()
+            document.add(self.compile_member(member))
+            document.clear()
 
-        methods = list(filter(self.filter, declaration.methods))
-        if methods:
-            document.add_heading('Methods', '-')
-            methods.sort(key=lambda m: m.name)
-            for method in methods:
-                if self.member_headers:
-                    document.add_heading(method.name, '^')
-                m = self.compile_method(method)
-                m.add_option('outertype', name)
-                document.add_object(m)
+            if i == 0 and section:
+                document.add_heading(section, '-')
 
         return document
 
@@ -291,6 +473,12 @@ class JavadocRestCompiler(object):
         """ Compile autodocs for the given Java syntax tree. Documents will be
         returned documenting each separate type. """
 
+        try:
+            return self.__compile(ast)
+        finally:
+            self.clear_docblocks()
+
+    def __compile(self, ast):
         documents = {}
 
         imports = util.StringBuilder()
@@ -334,12 +522,28 @@ class JavadocRestCompiler(object):
             name = '.'.join(classes)
             type_declarations.append((package, name, node))
 
+        # Convert the documentation of the whole file in one go, leaving out
+        # members whose directives are found in the memo
+        type_members = []
+        documented = []
         for package, name, declaration in type_declarations:
+            members = self.members(name, declaration)
+            type_members.append(members)
+
+            for member in members:
+                if self.__lookup_member(member) is None:
+                    documented.append(member.node)
+        self.convert_docblocks(documented)
+
+        for (package, name, declaration), members in zip(type_declarations, type_members):
             full_name = package + '.' + name
-            document = self.compile_type_document(import_block, package, name, declaration)
+            document = self.compile_type_document(import_block, package, name, declaration, members)
             documents[full_name] = (package, name, document.build())
         return documents
 
     def compile_docblock(self, documented):
         ''' Compiles a single, standalone docblock. '''
-        return self.__output_doc(documented).build()
+        try:
+            return self.__output_doc(documented).build()
+        finally:
+            self.clear_docblocks()
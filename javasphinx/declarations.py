@@ -0,0 +1,226 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Declaration-only parsing of Java source files.
+
+javasphinx-apidoc only documents declarations, yet most of a typical source
+file is made up of the statements in method, constructor and initializer
+bodies. strip_bodies() finds those bodies with a light-weight scan over the
+tokens between the declarations, skipping each body by balancing its braces,
+and blanks them out before the source is handed to javalang. The tree javalang
+builds then holds the declarations only.
+
+Blanked bodies keep their newlines, so the positions of all remaining tokens,
+and with them the positions reported in syntax errors, are unchanged. Bodies
+declaring a local class, interface or enum are left alone since those types
+are documented as well. Sources the scan can't make sense of are returned
+unchanged.
+
+"""
+
+import re
+
+import javalang
+
+# Tokens between the bodies. Strings and comments are matched as a whole so
+# braces inside them aren't mistaken for structure.
+TOKEN = re.compile(r'''
+      (?P<space>\s+)
+    | (?P<comment>//[^\r\n]*|/\*.*?\*/)
+    | (?P<literal>"(?:[^"\\\r\n]|\\.)*"|'(?:[^'\\\r\n]|\\.)*')
+    | (?P<word>[^\W\d][\w$]*|\$[\w$]*)
+    | (?P<number>\.?\d[\w.]*)
+    | (?P<operator>(?:[=!<>&|^%*+\-~?:]|/(?![/*]))+)
+    | (?P<other>.)
+''', re.S | re.U | re.X)
+
+# Tokens within a body. Anything else is skipped without looking at it. An
+# unterminated string, character or comment matches one of the single
+# character alternatives.
+BODY_TOKEN = re.compile(r'''
+      //[^\r\n]*
+    | /\*.*?\*/
+    | "(?:[^"\\\r\n]|\\.)*"
+    | '(?:[^'\\\r\n]|\\.)*'
+    | (?<![\w$])(?:class|interface|enum)(?![\w$])
+    | [{}"']
+    | /\*
+''', re.S | re.U | re.X)
+
+# Unicode escapes are translated before Java source is tokenized, so an escaped
+# quote or brace would change the structure seen by javalang.
+ASCII_ESCAPE = re.compile(r'\\u+00[0-7][0-9a-fA-F]')
+
+TYPE_KEYWORDS = frozenset(['class', 'interface', 'enum'])
+
+class Unbalanced(Exception):
+    pass
+
+def skip_block(source, start):
+    """ Return the index of the brace closing the block opened at start, and
+    whether the block contains a type declaration.
+
+    """
+
+    depth = 0
+    declares_type = False
+
+    for match in BODY_TOKEN.finditer(source, start):
+        token = match.group()
+
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return match.start(), declares_type
+        elif token in TYPE_KEYWORDS:
+            # Class literals, e.g. String.class, don't declare anything
+            i = match.start() - 1
+            while i >= 0 and source[i].isspace():
+                i -= 1
+            if source[i] != '.':
+                declares_type = True
+        elif token in ('"', "'", '/*'):
+            raise Unbalanced()
+
+    raise Unbalanced()
+
+def blank(text):
+    """ Replace text by whitespace covering the same lines and columns. """
+
+    newlines = text.count('\n')
+    if newlines:
+        return '\n' * newlines + ' ' * (len(text) - text.rfind('\n') - 1)
+    return ' ' * len(text)
+
+def strip_bodies(source):
+    """ Return the given Java source with the contents of method, constructor
+    and initializer bodies replaced by whitespace.
+
+    """
+
+    if ASCII_ESCAPE.search(source):
+        return source
+
+    output = []
+    last = 0
+
+    # One entry per enclosing type body, true while in the constants of an enum
+    types = [False]
+
+    # State of the member declaration being scanned
+    parens = 0
+    parameters = assignment = annotation_default = False
+    declared = None
+    words = ()
+    previous = None
+
+    pos = 0
+    end = len(source)
+    match_token = TOKEN.match
+
+    try:
+        while pos < end:
+            match = match_token(source, pos)
+            kind = match.lastgroup
+            token = match.group()
+            pos = match.end()
+
+            if kind == 'space' or kind == 'comment':
+                continue
+            elif kind == 'other':
+                if token in ('"', "'", '/'):
+                    # Unterminated string, character or comment
+                    return source
+            elif kind == 'word' and parens == 0:
+                if token in TYPE_KEYWORDS and previous != '.':
+                    declared = token
+                elif token == 'default' and previous == ')':
+                    annotation_default = True
+
+                if words is not None:
+                    if token == 'static' and not words:
+                        words = ('static',)
+                    else:
+                        words = None
+            elif kind == 'operator' and parens == 0 and '=' in token:
+                assignment = True
+
+            if kind != 'word' and words is not None and token not in '{;':
+                words = None
+
+            previous = token
+
+            if token == '(':
+                parens += 1
+            elif token == ')':
+                parens -= 1
+                if parens == 0:
+                    parameters = True
+            elif token == ';' and parens == 0:
+                types[-1] = False
+            elif token == '}' and parens == 0:
+                if len(types) == 1:
+                    return source
+                types.pop()
+            elif token == '{':
+                start = pos - 1
+
+                if parens or declared is None and (assignment or annotation_default):
+                    # Array initializer, anonymous class or annotation value
+                    pos = skip_block(source, start)[0] + 1
+                    continue
+
+                if declared is not None or types[-1]:
+                    # Type body or the body of an enum constant
+                    types.append(declared == 'enum')
+                elif parameters or words is not None:
+                    # Method, constructor or initializer body
+                    close, declares_type = skip_block(source, start)
+                    if not declares_type:
+                        output.append(source[last:pos])
+                        output.append(blank(source[pos:close]))
+                        last = close
+                    pos = close + 1
+                else:
+                    pos = skip_block(source, start)[0] + 1
+                    continue
+            else:
+                continue
+
+            # A member declaration ended or a new one begins
+            if parens == 0 and token in '{};':
+                parameters = assignment = annotation_default = False
+                declared = None
+                words = ()
+    except Unbalanced:
+        return source
+
+    if not output:
+        return source
+
+    output.append(source[last:])
+    return ''.join(output)
+
+def parse(source):
+    """ Parse the declarations of a Java source file, skipping the statements
+    in method, constructor and initializer bodies.
+
+    """
+
+    return javalang.parse.parse(strip_bodies(source))
@@ -14,8 +14,15 @@
 # limitations under the License.
 #
 
+try:
+   import cPickle as pickle
+except:
+   import pickle
+
+import os.path
 import re
 import string
+import uuid
 
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
@@ -63,6 +70,17 @@ java_dot_lang = set([
     'UnsupportedClassVersionError', 'UnsupportedOperationException', 'VerifyError',
     'VirtualMachineError', 'Void'])
 
+SIGNATURE_PARSERS = {
+    'member': javalang.parse.parse_member_signature,
+    'constructor': javalang.parse.parse_constructor_signature,
+    'type': javalang.parse.parse_type_signature,
+}
+
+# Members parsed from directive signatures, keyed on the kind of signature and
+# the signature. Shared by all directives and builds in the process, so that
+# signatures repeated across documents are parsed only once.
+signature_memo = util.LRU(10000)
+
 class JavaObject(ObjectDescription):
     option_spec = {
         'noindex': directives.flag,
@@ -155,6 +173,25 @@ class JavaObject(ObjectDescription):
     def get_index_text(self, package, type, name):
         raise NotImplementedError
 
+    def parse_signature(self, kind, sig):
+        """ Return the member parsed from the given signature. The parsed
+        members are shared, so they must not be modified.
+
+        """
+
+        key = (kind, sig)
+        domain = self.env.get_domain('java')
+
+        member = domain.get_signature(key)
+        if member is None:
+            member = signature_memo.get(key)
+            if member is None:
+                member = SIGNATURE_PARSERS[kind](sig)
+                signature_memo.put(key, member)
+            domain.note_signature(key, member)
+
+        return member
+
     def get_package(self):
         return self.options.get('package', self.env.temp_data.get('java:package'))
 
@@ -175,7 +212,8 @@ class JavaObject(ObjectDescription):
             signode['first'] = (not self.names)
             self.state.document.note_explicit_target(signode)
 
-            objects = self.env.domaindata['java']['objects']
+            domain = self.env.get_domain('java')
+            objects = domain.data['objects']
             if fullname in objects:
                 self.state_machine.reporter.warning(
                     'duplicate object description of %s, ' % fullname +
@@ -183,7 +221,7 @@ class JavaObject(ObjectDescription):
                     ', use :noindex: for one of them',
                     line=self.lineno)
 
-            objects[fullname] = (self.env.docname, self.objtype, basename)
+            domain.note_object(fullname, self.env.docname, self.objtype, basename)
 
         indextext = self.get_index_text(package, type, name)
         if indextext:
@@ -212,7 +250,7 @@ class JavaMethod(JavaObject):
 
     def handle_method_signature(self, sig, signode):
         try:
-            member = javalang.parse.parse_member_signature(sig)
+            member = self.parse_signature('member', sig)
         except javalang.parser.JavaSyntaxError:
             raise self.error("syntax error in method signature")
 
@@ -262,7 +300,7 @@ class JavaConstructor(JavaObject):
 
     def handle_constructor_signature(self, sig, signode):
         try:
-            member = javalang.parse.parse_constructor_signature(sig)
+            member = self.parse_signature('constructor', sig)
         except javalang.parser.JavaSyntaxError:
             raise self.error("syntax error in constructor signature")
 
@@ -301,7 +339,7 @@ class JavaType(JavaObject):
 
     def handle_type_signature(self, sig, signode):
         try:
-            member = javalang.parse.parse_type_signature(sig)
+            member = self.parse_signature('type', sig)
         except javalang.parser.JavaSyntaxError:
             raise self.error("syntax error in field signature")
 
@@ -362,7 +400,7 @@ class JavaType(JavaObject):
 class JavaField(JavaObject):
     def handle_field_signature(self, sig, signode):
         try:
-            member = javalang.parse.parse_member_signature(sig)
+            member = self.parse_signature('member', sig)
         except javalang.parser.JavaSyntaxError:
             raise self.error("syntax error in field signature")
 
@@ -413,7 +451,7 @@ class JavaPackage(Directive):
         package = self.arguments[0].strip()
         noindex = 'noindex' in self.options
         env.temp_data['java:package'] = package
-        env.domaindata['java']['objects'][package] = (env.docname, 'package', package)
+        env.get_domain('java').note_object(package, env.docname, 'package', package)
         ret = []
 
         if not noindex:
@@ -514,77 +552,314 @@ class JavaDomain(Domain):
     }
 
     initial_data = {
-        'objects': {},  # fullname -> docname, objtype, basename
+        'objects': {},   # fullname -> docname, objtype, basename
+        'names': {},     # last component of fullname -> fullnames
+        'basenames': {}, # last component of basename -> fullnames
+        'docnames': {},  # docname -> fullnames
+        'xrefs': {},     # last component of target -> (target, package, outertype, imported)
+                         # -> fullname, external target
+        'xref_deps': {}, # last component of basename -> last components of targets
+        'xref_url_map': {}, # javadoc_url_map the external targets were found with
+        'xref_build': None, # id of the objects the resolved references were found among
+        'signatures': util.LRU(0), # kind, signature -> parsed member
     }
 
-    def clear_doc(self, docname):
-        objects = dict(self.data['objects'])
+    # Objects with their indexes, resolved references and parsed signatures
+    data_version = 1
 
-        for fullname, (fn, _, _) in objects.items():
-            if fn == docname:
-                del self.data['objects'][fullname]
+    # File in the doctree directory holding the references resolved by the
+    # last build
+    xrefs_filename = 'javasphinx-xrefs.pickle'
+
+    def note_object(self, fullname, docname, objtype, basename):
+        """ Record an object. An object of the same name described by a
+        document sorting after docname is kept, so that the outcome doesn't
+        depend on the order documents are read in; a serial build reads them
+        sorted by name.
+
+        The objects are also indexed by the last component of their full name
+        and basename, so that a reference can be matched against the objects
+        sharing its last component rather than all of them, and by document,
+        so that clearing a document only touches its own objects. The
+        fullnames in each index entry are kept in the order they were
+        recorded in.
+
+        """
 
-    def resolve_xref(self, env, fromdocname, builder, typ, target, node, contnode):
         objects = self.data['objects']
-        package = node.get('java:package')
-        imported = node.get('java:imported')
-        type_context = node.get('java:outertype')
+        previous = objects.get(fullname)
+
+        if previous is None:
+            self.data['names'].setdefault(_last_component(fullname), []).append(fullname)
+            self.data['basenames'].setdefault(_last_component(basename), []).append(fullname)
+        elif docname < previous[0]:
+            return
+
+        if previous is None or docname != previous[0]:
+            if previous is not None:
+                _remove_indexed(self.data['docnames'], previous[0], fullname)
+            self.data['docnames'].setdefault(docname, []).append(fullname)
+            self.forget_xrefs(fullname, basename)
+
+        objects[fullname] = (docname, objtype, basename)
+
+    def remove_object(self, fullname):
+        docname, _, basename = self.data['objects'].pop(fullname)
+
+        _remove_indexed(self.data['docnames'], docname, fullname)
+        _remove_indexed(self.data['names'], _last_component(fullname), fullname)
+        _remove_indexed(self.data['basenames'], _last_component(basename), fullname)
+        self.forget_xrefs(fullname, basename)
+
+    def forget_xrefs(self, fullname, basename):
+        """ Forget the resolved references an object being added or removed
+        may resolve differently.
+
+        A target can only resolve to objects whose fullname has the same last
+        component, or whose basename has the same last component as the
+        target's basename. The resolved references are grouped by the last
+        component of their target, and the targets are recorded by the last
+        component of their basename, so only those groups are forgotten.
+
+        """
+
+        # The objects differ from those saved with any stored references
+        self.data['xref_build'] = None
+
+        xrefs = self.data['xrefs']
+
+        xrefs.pop(_last_component(fullname), None)
+        for name in self.data['xref_deps'].pop(_last_component(basename), ()):
+            xrefs.pop(name, None)
+
+    def load_xrefs(self, doctreedir):
+        """ Restore the references resolved by the previous build. References
+        are resolved while writing, after the environment has been saved, so
+        they are stored in a file of their own by save_xrefs(). They are only
+        used if they were resolved among the objects of this environment, as
+        told by the id stored with both; otherwise they may refer to objects
+        the environment doesn't know. The id is replaced by update_build()
+        whenever the objects change.
+
+        """
+
+        build = self.data['xref_build']
+
+        if build is None:
+            return
+
+        try:
+            f = open(os.path.join(doctreedir, self.xrefs_filename), 'rb')
+        except IOError:
+            return
+
+        try:
+            stored_build, xrefs, xref_deps, url_map = pickle.load(f)
+        except Exception:
+            # A corrupt file is ignored and replaced at the end of the build
+            return
+        finally:
+            f.close()
+
+        if stored_build == build:
+            self.data['xrefs'] = xrefs
+            self.data['xref_deps'] = xref_deps
+            self.data['xref_url_map'] = url_map
+
+    def update_build(self):
+        """ Give the objects a new id if they changed while reading. Sphinx
+        saves the environment whenever documents were read, so an unchanged id
+        means the saved environment still holds the same objects.
+
+        """
+
+        if self.data['xref_build'] is None:
+            self.data['xref_build'] = uuid.uuid4().hex
+
+    def save_xrefs(self, doctreedir):
+        """ Store the references resolved by this build for load_xrefs(). """
+
+        data = (self.data['xref_build'], self.data['xrefs'], self.data['xref_deps'],
+                self.data['xref_url_map'])
+
+        f = open(os.path.join(doctreedir, self.xrefs_filename), 'wb')
+        try:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
 
-        # Partial function to make building the response easier
-        make_ref = lambda fullname: make_refnode(builder, fromdocname, objects[fullname][0], fullname, contnode, fullname)
+    def _signatures(self):
+        """ Return the parsed members kept in the environment. At most
+        java_signature_cache members are kept, the least recently used are
+        evicted first; a size of 0 keeps none.
+
+        """
+
+        signatures = self.data['signatures']
+        signatures.resize(self.env.config.java_signature_cache)
+        return signatures
+
+    def get_signature(self, key):
+        """ Return the member parsed from the signature under key by an
+        earlier build, or None. """
+
+        return self._signatures().get(key)
+
+    def note_signature(self, key, member):
+        """ Keep the member parsed from the signature under key in the
+        environment. """
+
+        self._signatures().put(key, member)
+
+    def merge_domaindata(self, docnames, otherdata):
+        """ Add the objects described by the given documents, read by another
+        process during a parallel build. The objects of each document are
+        recorded in the order they were described in.
+
+        """
+
+        objects = otherdata['objects']
+
+        for docname in docnames:
+            for fullname in otherdata['docnames'].get(docname, ()):
+                _, objtype, basename = objects[fullname]
+                self.note_object(fullname, docname, objtype, basename)
+
+        signatures = self._signatures()
+        for key, member in otherdata['signatures'].items():
+            if key not in signatures:
+                signatures.put(key, member)
+
+    def clear_doc(self, docname):
+        for fullname in list(self.data['docnames'].get(docname, ())):
+            self.remove_object(fullname)
+
+    def find_target(self, target, package, type_context, imported):
+        """ Return the fullname of the object the target refers to and None,
+        or None and the target to look up in external documentation. Both are
+        None if the target can't be resolved.
+
+        """
+
+        objects = self.data['objects']
 
         # Check for fully qualified references
         if target in objects:
-            return make_ref(target)
+            return target, None
 
         # Try with package name prefixed
         if package:
             fullname = package + '.' + target
             if fullname in objects:
-                return make_ref(fullname)
+                return fullname, None
 
         # Try with package and type prefixed
         if package and type_context:
             fullname = package + '.' + type_context + '.' + target
             if fullname in objects:
-                return make_ref(fullname)
+                return fullname, None
 
-        # Try to find a matching suffix
+        # Try to find a matching suffix. Only objects with the same last
+        # component can match. Of several matches the first one in the order
+        # of a serial build wins, i.e. the first one recorded by the document
+        # sorting first.
         suffix = '.' + target
-        basename_match = None
-        basename_suffix = suffix.partition('(')[0]
+        match = None
+        for fullname in self.data['names'].get(_last_component(suffix), ()):
+            if not fullname.endswith(suffix):
+                continue
+            if match is None or objects[fullname][0] < objects[match][0]:
+                match = fullname
 
-        for fullname, (_, _, basename) in objects.items():
-            if fullname.endswith(suffix):
-                return make_ref(fullname)
-            elif basename.endswith(basename_suffix):
-                basename_match = fullname
+        if match is not None:
+            return match, None
 
-        if basename_match:
-            return make_ref(basename_match)
+        # Try to find a matching basename suffix, the last one matching wins
+        basename_suffix = suffix.partition('(')[0]
+        for fullname in self.data['basenames'].get(_last_component(basename_suffix), ()):
+            if not objects[fullname][2].endswith(basename_suffix):
+                continue
+            if match is None or objects[fullname][0] >= objects[match][0]:
+                match = fullname
+
+        if match is not None:
+            return match, None
 
         # Try creating an external documentation reference
-        ref = extdoc.get_javadoc_ref(self.env, target, target)
+        fulltargets = [target]
 
-        if not ref and target in java_dot_lang:
-            fulltarget = 'java.lang.' + target
-            ref = extdoc.get_javadoc_ref(self.env, fulltarget, fulltarget)
+        if target in java_dot_lang:
+            fulltargets.append('java.lang.' + target)
 
         # If the target was imported try with the package prefixed
-        if not ref and imported:
-            fulltarget = package + '.' + target
-            ref = extdoc.get_javadoc_ref(self.env, fulltarget, fulltarget)
+        if imported:
+            fulltargets.append(package + '.' + target)
+
+        for fulltarget in fulltargets:
+            if extdoc.get_javadoc_ref(self.env, fulltarget, fulltarget):
+                return None, fulltarget
+
+        return None, None
 
-        if ref:
+    def resolve_xref(self, env, fromdocname, builder, typ, target, node, contnode):
+        package = node.get('java:package')
+        imported = node.get('java:imported')
+        type_context = node.get('java:outertype')
+
+        # External targets depend on the configuration, which may change
+        # between builds without the environment being discarded
+        url_map = extdoc.get_javadoc_url_map(self.env)
+        if url_map != self.data['xref_url_map']:
+            self.data['xrefs'].clear()
+            self.data['xref_deps'].clear()
+            self.data['xref_url_map'] = dict(url_map)
+
+        name = _last_component(target)
+        key = (target, package, type_context, imported)
+
+        xrefs = self.data['xrefs'].setdefault(name, {})
+        if key in xrefs:
+            fullname, fulltarget = xrefs[key]
+        else:
+            fullname, fulltarget = xrefs[key] = self.find_target(target, package, type_context,
+                                                                 imported)
+
+            basename = _last_component(target.partition('(')[0])
+            self.data['xref_deps'].setdefault(basename, set()).add(name)
+
+        if fullname is not None:
+            docname = self.data['objects'][fullname][0]
+            return make_refnode(builder, fromdocname, docname, fullname, contnode, fullname)
+
+        if fulltarget is not None:
+            ref = extdoc.get_javadoc_ref(self.env, fulltarget, fulltarget)
             ref.append(contnode)
             return ref
-        else:
-            return None
+
+        return None
 
     def get_objects(self):
         for refname, (docname, type, _) in self.data['objects'].items():
             yield (refname, refname, type, docname, refname, 1)
 
+def load_resolved_xrefs(app):
+    app.env.get_domain('java').load_xrefs(app.doctreedir)
+
+def update_xrefs_build(app, env):
+    env.get_domain('java').update_build()
+
+def save_resolved_xrefs(app, exception):
+    if exception is None:
+        app.env.get_domain('java').save_xrefs(app.doctreedir)
+
+def _last_component(name):
+    return name.rpartition('.')[2]
+
+def _remove_indexed(index, key, fullname):
+    fullnames = index[key]
+    fullnames.remove(fullname)
+    if not fullnames:
+        del index[key]
 
 def _create_indexnode(indextext, fullname):
     # See https://github.com/sphinx-doc/sphinx/issues/2673
@@ -19,7 +19,10 @@ import re
 from docutils import nodes, utils
 from sphinx.util.nodes import split_explicit_title
 
-def get_javadoc_ref(app, rawtext, text):
+def get_javadoc_url_map(app):
+    """ Return the javadoc_url_map configuration with the default Java SE
+    sources added. """
+
     javadoc_url_map = app.config.javadoc_url_map
 
     # Add default Java SE sources
@@ -32,6 +35,11 @@ def get_javadoc_ref(app, rawtext, text):
     if not javadoc_url_map.get("org.w3c"):
         javadoc_url_map["org.w3c"] = ("http://docs.oracle.com/javase/8/docs/api", 'javadoc8')
 
+    return javadoc_url_map
+
+def get_javadoc_ref(app, rawtext, text):
+    javadoc_url_map = get_javadoc_url_map(app)
+
     source = None
     package = ''
     method = None
@@ -22,12 +22,121 @@ import re
 
 from xml.sax.saxutils import escape as html_escape
 from bs4 import BeautifulSoup
+from lxml import etree
+
+import javasphinx.stats as stats
+import javasphinx.util as util
 
 Cell = collections.namedtuple('Cell', ['type', 'rowspan', 'colspan', 'contents'])
 
+class ConversionMemo(util.LRU):
+    """ Least recently used memo of converted HTML fragments, keyed on the
+    parser and the fragment. The fragments and the reST converted from them
+    take up at most max_size bytes; a size of 0 disables the memo.
+
+    The fragments converted by earlier runs are returned by the load function,
+    which is only called once the memo is first used, so runs that don't
+    convert anything don't pay for loading them. changed tells whether
+    fragments were added since, i.e. whether the memo needs to be saved.
+
+    The copies returned by for_worker() also remember the fragments they
+    converted, which the parent process collects through take_worker_state()
+    so that they can be persisted along with its own.
+
+    """
+
+    # File the entries are stored in within the cache directory
+    store_name = 'convert-memo.p'
+    label = 'Conversion memo'
+
+    def __init__(self, max_size=8 * 1024 * 1024, load=None):
+        util.LRU.__init__(self, max_size, util.text_size)
+
+        self.load = load
+        self.changed = False
+
+        self.is_worker = False
+        self.added = []
+
+    def get(self, key):
+        if self.load is not None:
+            self.ensure_loaded()
+
+        return util.LRU.get(self, key)
+
+    def put(self, key, rst):
+        if self.max_size <= 0:
+            return
+
+        if self.load is not None:
+            self.ensure_loaded()
+
+        util.LRU.put(self, key, rst)
+        self.changed = True
+
+        if self.is_worker:
+            self.added.append((key, rst))
+
+    def ensure_loaded(self):
+        """ Add the fragments converted by earlier runs, if they haven't been
+        yet. Fragments added in the meantime are kept as the most recently
+        used.
+
+        """
+
+        load, self.load = self.load, None
+        if load is None:
+            return
+
+        with stats.span('cache'):
+            stored = load()
+
+        added = self.items()
+        evicted = self.evicted
+
+        self.entries.clear()
+        self.size = 0
+
+        for key, rst in stored:
+            util.LRU.put(self, key, rst)
+        for key, rst in added:
+            util.LRU.put(self, key, rst)
+
+        self.evicted = evicted
+
+    def for_worker(self):
+        worker_memo = type(self)(self.max_size, self.load)
+        worker_memo.entries.update(self.entries)
+        worker_memo.size = self.size
+        worker_memo.is_worker = True
+        return worker_memo
+
+    def take_worker_state(self):
+        state = (self.added, self.hits, self.misses, self.evicted)
+
+        self.added = []
+        self.hits = self.misses = self.evicted = 0
+
+        return state
+
+    def merge_worker_state(self, state):
+        added, hits, misses, evicted = state
+
+        for key, rst in added:
+            self.put(key, rst)
+        self.hits += hits
+        self.misses += misses
+        self.evicted += evicted
+
+    def report(self):
+        return '%s, entries: %d (%d KiB), evicted: %d' % (
+            stats.format_hits(self.label, self.hits, self.misses), len(self.entries),
+            self.size // 1024, self.evicted)
+
 class Converter(object):
-    def __init__(self, parser):
+    def __init__(self, parser, memo=None):
         self._unknown_tags = set()
+        self._memo = memo
         self._clear = '\n\n..\n\n'
 
         # Regular expressions
@@ -38,9 +147,70 @@ class Converter(object):
         self._whitespace = re.compile(r'\s+')
         self._html_tag = re.compile(r'<.*?>')
 
+        # Anything the HTML parser or preprocessing would not pass through as
+        # plain text: tags, entities, inline Javadoc tags, NUL characters and a
+        # leading byte order mark, which Beautiful Soup drops
+        self._markup = re.compile(r'^\ufeff|[<&\x00]|\{@')
+
         self._preprocess_entity = re.compile(r'&(nbsp|lt|gt|amp)([^;]|[\n])')
+        self._brackets = re.compile(r'[{}]')
         self._parser = parser
 
+        # Tags converted from their text alone
+        self._simple_tags = {
+            'b'      : lambda s: self._inline('**', s),
+            'strong' : lambda s: self._inline('**', s),
+            'i'      : lambda s: self._inline('*', s),
+            'em'     : lambda s: self._inline('*', s),
+            'tt'     : lambda s: self._inline('``', s),
+            'code'   : lambda s: self._inline('``', s),
+            'h1'     : lambda s: self._inline('**', s),
+            'h2'     : lambda s: self._inline('**', s),
+            'h3'     : lambda s: self._inline('**', s),
+            'h4'     : lambda s: self._inline('**', s),
+            'h5'     : lambda s: self._inline('**', s),
+            'h6'     : lambda s: self._inline('**', s),
+            'sub'    : lambda s: self._role('sub', s),
+            'sup'    : lambda s: self._role('sup', s),
+            'hr'     : lambda s: self._separate('') # Transitions not allowed
+            }
+
+        # Inline Javadoc tags, in the order they are replaced. {@linkplain must
+        # come before {@link, which is a prefix of it.
+        to_tag = lambda t: lambda m: '<%s>%s</%s>' % (t, html_escape(m), t)
+        self._inline_tags = [
+            ('{@code', to_tag('code')),
+            ('{@literal', to_tag('span')),
+            ('{@docRoot', lambda m: ''),
+            ('{@linkplain', self._preprocess_replace_javadoc_link),
+            ('{@link', self._preprocess_replace_javadoc_link)
+            ]
+
+        # Fragments converted together by convert_many() are each wrapped in a
+        # div with an id of this prefix followed by the fragment's index
+        self._fragment_prefix = 'javasphinx-fragment-'
+        self._fragment_id = re.compile('^' + self._fragment_prefix)
+
+        # Markup parsed differently at the start of a document or which could
+        # swallow the following fragments: comments, doctypes, processing
+        # instructions, document structure and raw text elements. Fragments of
+        # nothing but end tags do not parse into a document on their own, and a
+        # leading byte order mark is only dropped at the start of a document.
+        self._unbatchable = re.compile(
+            r'^\ufeff|<\s*/?\s*(?:[!?]|(?:html|head|body|title|meta|link|base|script|style|textarea|xmp|'
+            r'plaintext|iframe|noscript|noembed|noframes|frameset|frame)\b)|'
+            r'^(?:\s|</[^>]*>)*$', re.IGNORECASE)
+
+        # Only the lxml parser is known to parse wrapped fragments the same way
+        # it parses them on their own
+        self._batch = parser == 'lxml'
+
+        # The stream engine converts the events of lxml's HTML parser as they
+        # are parsed instead of walking a Beautiful Soup tree
+        self._stream = parser == 'stream'
+        self._event_converter = None
+        self._event_parser = None
+
     # --------------------------------------------------------------------------
     # ---- reST Utility Methods ----
 
@@ -91,6 +261,28 @@ class Converter(object):
         items = [marker + item[len(marker):] for item in items]
         return self._separate('..') + self._separate('\n'.join(items))
 
+    def _list_item(self, s):
+        s = s.strip()
+
+        # If it's multiline clear the end to correcly support nested lists
+        if '\n' in s:
+            s = s + '\n\n'
+
+        return s
+
+    def _anchor(self, name):
+        return self._separate('.. _' + name + ':')
+
+    def _link(self, target, text):
+        label = self._compress_whitespace(text.strip('\n'))
+
+        if target.startswith('#'):
+            return self._role('ref', target[1:], label)
+        elif target.startswith('@'):
+            return self._role('java:ref', target[1:], label)
+        else:
+            return self._hyperlink(target, label)
+
     def _left_justify(self, s, indent=0):
         lines = [l.rstrip() for l in s.split('\n')]
         indents = [len(l) - len(l.lstrip()) for l in lines if l]
@@ -148,8 +340,9 @@ class Converter(object):
         return rows
 
     def _process_table(self, node):
-        rows = self._process_table_cells(node)
+        return self._format_table(self._process_table_cells(node))
 
+    def _format_table(self, rows):
         if not rows:
             return ''
 
@@ -239,26 +432,8 @@ class Converter(object):
         if isinstance(node, str):
             return self._compress_whitespace(node)
 
-        simple_tags = {
-            'b'      : lambda s: self._inline('**', s),
-            'strong' : lambda s: self._inline('**', s),
-            'i'      : lambda s: self._inline('*', s),
-            'em'     : lambda s: self._inline('*', s),
-            'tt'     : lambda s: self._inline('``', s),
-            'code'   : lambda s: self._inline('``', s),
-            'h1'     : lambda s: self._inline('**', s),
-            'h2'     : lambda s: self._inline('**', s),
-            'h3'     : lambda s: self._inline('**', s),
-            'h4'     : lambda s: self._inline('**', s),
-            'h5'     : lambda s: self._inline('**', s),
-            'h6'     : lambda s: self._inline('**', s),
-            'sub'    : lambda s: self._role('sub', s),
-            'sup'    : lambda s: self._role('sup', s),
-            'hr'     : lambda s: self._separate('') # Transitions not allowed
-            }
-
-        if node.name in simple_tags:
-            return simple_tags[node.name](self._process_text(node))
+        if node.name in self._simple_tags:
+            return self._simple_tags[node.name](self._process_text(node))
 
         if node.name == 'p':
             return self._separate(self._process_children(node).strip())
@@ -268,17 +443,9 @@ class Converter(object):
 
         if node.name == 'a':
             if 'name' in node.attrs:
-                return self._separate('.. _' + node['name'] + ':')
+                return self._anchor(node['name'])
             elif 'href' in node.attrs:
-                target = node['href']
-                label = self._compress_whitespace(self._process_text(node).strip('\n'))
-
-                if target.startswith('#'):
-                    return self._role('ref', target[1:], label)
-                elif target.startswith('@'):
-                    return self._role('java:ref', target[1:], label)
-                else:
-                    return self._hyperlink(target, label)
+                return self._link(node['href'], self._process_text(node))
 
         if node.name == 'ul':
             items = [self._process(n) for n in node.find_all('li', recursive=False)]
@@ -289,14 +456,7 @@ class Converter(object):
             return self._listing('#.', items)
 
         if node.name == 'li':
-            s = self._process_children(node)
-            s = s.strip()
-
-            # If it's multiline clear the end to correcly support nested lists
-            if '\n' in s:
-                s = s + '\n\n'
-
-            return s
+            return self._list_item(self._process_children(node))
 
         if node.name == 'table':
             return self._process_table(node)
@@ -308,6 +468,24 @@ class Converter(object):
     # --------------------------------------------------------------------------
     # ---- HTML Preprocessing ----
 
+    def _find_closing_bracket(self, s, i):
+        """ Return the index just past the } closing the { at index i, such that
+        the brackets are balanced between them, or -1 if there is none.
+
+        """
+
+        depth = 0
+
+        for m in self._brackets.finditer(s, i):
+            if m.group() == '{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return m.end()
+
+        return -1
+
     def _preprocess_inline_javadoc_replace(self, tag, f, s):
         parts = []
 
@@ -324,11 +502,8 @@ class Converter(object):
             # them. This is necessary since code examples containing { and } are
             # commonly wrapped in {@code ...} tags
 
-            try:
-                j = s.find('}', i + start_length) + 1
-                while s.count('{', i, j) != s.count('}', i, j):
-                    j = s.index('}', j) + 1
-            except ValueError:
+            j = self._find_closing_bracket(s, i)
+            if j == -1:
                 raise ValueError('Unbalanced {} brackets in ' + tag + ' tag')
 
             parts.append(f(s[i + start_length:j - 1].strip()))
@@ -338,6 +513,65 @@ class Converter(object):
 
         return ''.join(parts)
 
+    def _preprocess_inline_javadoc_scan(self, s):
+        """ Replace all inline Javadoc tags in a single scan. Returns None if tags
+        are nested, unbalanced or otherwise depend on the order in which the
+        tags are replaced by _preprocess_inline_javadoc, in which case the tags
+        have to be replaced one kind at a time.
+
+        """
+
+        parts = []
+
+        i = s.find('{@')
+        j = 0
+
+        while i != -1:
+            for start, f in self._inline_tags:
+                if s.startswith(start, i):
+                    break
+            else:
+                # Not a tag we replace, but tags within it are
+                i = s.find('{@', i + 2)
+                continue
+
+            end = self._find_closing_bracket(s, i)
+            if end == -1 or s.find('{@', i + 2, end) != -1:
+                return None
+
+            # Removing a {@docRoot} must not join a { and an @ into a new tag
+            if start == '{@docRoot' and ((i > 0 and s[i - 1] == '{') or s.startswith('@', end) or
+                                         s.startswith('{', end)):
+                return None
+
+            try:
+                replacement = f(s[i + len(start):end - 1].strip())
+            except Exception:
+                return None
+
+            parts.append(s[j:i])
+            parts.append(replacement)
+
+            j = end
+            i = s.find('{@', j)
+
+        parts.append(s[j:])
+
+        return ''.join(parts)
+
+    def _preprocess_inline_javadoc(self, s):
+        if '{@' not in s:
+            return s
+
+        result = self._preprocess_inline_javadoc_scan(s)
+        if result is not None:
+            return result
+
+        for start, f in self._inline_tags:
+            s = self._preprocess_inline_javadoc_replace(start[2:], f, s)
+
+        return s
+
     def _preprocess_replace_javadoc_link(self, s):
         s = self._compress_whitespace(s)
 
@@ -379,12 +613,7 @@ class Converter(object):
         return self._preprocess_entity.sub(r'&\1;\2', s)
 
     def _preprocess(self, s_html):
-        to_tag = lambda t: lambda m: '<%s>%s</%s>' % (t, html_escape(m), t)
-        s_html = self._preprocess_inline_javadoc_replace('code', to_tag('code'), s_html)
-        s_html = self._preprocess_inline_javadoc_replace('literal', to_tag('span'), s_html)
-        s_html = self._preprocess_inline_javadoc_replace('docRoot', lambda m: '', s_html)
-        s_html = self._preprocess_inline_javadoc_replace('linkplain', self._preprocess_replace_javadoc_link, s_html)
-        s_html = self._preprocess_inline_javadoc_replace('link', self._preprocess_replace_javadoc_link, s_html)
+        s_html = self._preprocess_inline_javadoc(s_html)
 
         # Make sure all anchor tags are closed
         s_html = self._preprocess_close_anchor_tags(s_html)
@@ -397,23 +626,427 @@ class Converter(object):
     # --------------------------------------------------------------------------
     # ---- Conversion entry point ----
 
+    @stats.timed('convert')
     def convert(self, s_html):
         if not isinstance(s_html, str):
             s_html = str(s_html, 'utf8')
 
+        # Plain text converts to itself with whitespace compressed, so there is
+        # no need to preprocess and parse it
+        if not self._markup.search(s_html):
+            return self._compress_whitespace(s_html).strip()
+
+        if self._memo is None:
+            return self._convert_html(s_html)
+
+        key = (self._parser, s_html)
+        rst = self._memo.get(key)
+
+        if rst is None:
+            rst = self._convert_html(s_html)
+            self._memo.put(key, rst)
+
+        return rst
+
+    def _convert_html(self, s_html):
         s_html = self._preprocess(s_html)
 
         if not s_html.strip():
             return ''
 
+        if self._stream:
+            return self._post_process(self._convert_events(s_html))
+
         soup = BeautifulSoup(s_html, self._parser)
         top = soup.html.body
 
-        result = self._process_children(top)
+        return self._post_process(self._process_children(top))
 
-        # Post processing
+    def _convert_events(self, s_html):
+        if self._event_parser is None:
+            self._event_converter = EventConverter(self)
+            self._event_parser = etree.HTMLParser(target=self._event_converter, recover=True)
+
+        # Beautiful Soup drops a leading byte order mark before parsing
+        if s_html.startswith('\ufeff'):
+            s_html = s_html[1:]
+
+        self._event_converter.reset()
+        self._event_parser.feed(s_html)
+
+        return self._event_parser.close()
+
+    def _post_process(self, result):
         result = self._post_process_empty_lines.sub('', result)
         result = self._post_process_compress_lines.sub('\n\n', result)
         result = result.strip()
 
         return result
+
+    @stats.timed('convert')
+    def convert_many(self, fragments):
+        """ Convert a list of HTML fragments, returning the converted fragments
+        in the same order. The result is the same as converting each fragment
+        with convert(), but fragments containing markup are parsed together as
+        a single document.
+
+        """
+
+        results = [None] * len(fragments)
+        sources = [None] * len(fragments)
+        batch = []
+
+        for i, s_html in enumerate(fragments):
+            if not isinstance(s_html, str):
+                s_html = str(s_html, 'utf8')
+
+            if not self._markup.search(s_html):
+                results[i] = self._compress_whitespace(s_html).strip()
+                continue
+
+            if self._memo is not None:
+                results[i] = self._memo.get((self._parser, s_html))
+                if results[i] is not None:
+                    continue
+
+            sources[i] = s_html
+            s_html = self._preprocess(s_html)
+
+            if not s_html.strip():
+                results[i] = ''
+            elif not self._batch or self._fragment_prefix in s_html or self._unbatchable.search(s_html):
+                results[i] = self._convert_html(sources[i])
+            else:
+                batch.append((i, s_html))
+
+        if len(batch) == 1:
+            i, _ = batch[0]
+            results[i] = self._convert_html(sources[i])
+        elif batch:
+            for i, result in self._convert_batch(batch):
+                results[i] = result if result is not None else self._convert_html(sources[i])
+
+        if self._memo is not None:
+            for i, s_html in enumerate(sources):
+                if s_html is not None:
+                    self._memo.put((self._parser, s_html), results[i])
+
+        return results
+
+    def _convert_batch(self, batch):
+        """ Convert preprocessed fragments, given as (index, fragment) pairs, by
+        parsing them as a single document. Yields (index, result) pairs, where
+        the result is None for fragments which did not parse into a container
+        of their own (e.g. because of an unclosed table) and have to be
+        converted separately.
+
+        """
+
+        s_html = ''.join('<div id="%s%d">%s</div>' % (self._fragment_prefix, k, fragment)
+                         for k, (_, fragment) in enumerate(batch))
+
+        soup = BeautifulSoup(s_html, self._parser)
+        top = soup.html.body if soup.html else None
+
+        if top is None:
+            for i, _ in batch:
+                yield i, None
+            return
+
+        containers = {}
+        untrusted = set()
+        current = 0
+
+        # A fragment's container must be a child of the body with nothing but
+        # whitespace between it and the next container
+        for node in top.contents:
+            if isinstance(node, str):
+                if node.strip():
+                    untrusted.add(current)
+            elif node.name == 'div' and self._fragment_id.match(node.get('id', '')):
+                current = int(node['id'][len(self._fragment_prefix):])
+                containers[current] = node
+            else:
+                untrusted.add(current)
+
+        # Containers swallowing other containers did not close where expected
+        for node in top.find_all('div', id=self._fragment_id):
+            if node.parent is not top:
+                parent = node.find_parent('div', id=self._fragment_id)
+                if parent is not None:
+                    untrusted.add(int(parent['id'][len(self._fragment_prefix):]))
+
+        for k, (i, _) in enumerate(batch):
+            if k in containers and k not in untrusted:
+                yield i, self._post_process(self._process_children(containers[k]))
+            else:
+                yield i, None
+
+class OpenElement(object):
+    """ An element of a document being converted by EventConverter which has
+    been started but not ended yet.
+
+    """
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+        # The conversion of the element, if it is converted at all, and what
+        # it is converted from: 'text', 'children', 'items', 'rows' or None
+        self.convert = None
+        self.needs = None
+
+        # Whether the element's children are converted and joined into parts
+        self.children = False
+        self.parts = None
+        self.is_newline = False
+
+        self.text = None
+        self.text_start = 0
+        self.items = None
+        self.rows = None
+
+        # The cells of a table row, if the element is a row of a table being
+        # converted, and whether the element is such a cell
+        self.row = None
+        self.cell = False
+
+    def add_part(self, part):
+        if self.is_newline:
+            part = part.lstrip()
+
+        if part:
+            self.parts.append(part)
+            self.is_newline = part.endswith('\n')
+
+    def content(self):
+        return ''.join(self.parts)
+
+class EventConverter(object):
+    """ lxml parser target converting an HTML document to reST as it is parsed,
+    without building a tree. The result is the same as the one Converter
+    produces from the tree Beautiful Soup builds with the lxml parser, so the
+    strings of the document are merged and collapsed the way Beautiful Soup
+    does it.
+
+    """
+
+    # Beautiful Soup keeps whitespace within these elements as is, and does
+    # not count the strings within the other ones as text
+    preserve_whitespace = frozenset(['pre', 'textarea'])
+    string_containers = frozenset(['rt', 'rp', 'style', 'script', 'template'])
+    ascii_spaces = '\x20\x0a\x09\x0c\x0d'
+
+    def __init__(self, converter):
+        self.converter = converter
+
+        c = converter
+        text = lambda f: ('text', lambda e: f(e.text))
+
+        # Conversion of each element by name, as (what the conversion needs,
+        # conversion function). Anchors are resolved by their attributes.
+        self.dispatch = dict((name, text(f)) for name, f in c._simple_tags.items())
+        self.dispatch.update({
+            'p'     : ('children', lambda e: c._separate(e.content().strip())),
+            'pre'   : text(lambda s: c._directive('parsed-literal', s)),
+            'ul'    : ('items', lambda e: c._listing('*', e.items)),
+            'ol'    : ('items', lambda e: c._listing('#.', e.items)),
+            'li'    : ('children', lambda e: c._list_item(e.content())),
+            'table' : ('rows', self._convert_table)
+            })
+        self.anchor = (None, lambda e: c._anchor(e.attrs['name']))
+        self.link = ('text', lambda e: c._link(e.attrs['href'], e.text))
+        self.unknown = ('children', OpenElement.content)
+
+        self.reset()
+
+    def reset(self):
+        self.stack = [OpenElement(None, {})]
+        self.pending = []
+
+        # Text strings within the elements converted from their text
+        self.texts = []
+        self.collecting = 0
+
+        self.preserving = 0
+        self.containers = 0
+        self.tables = []
+
+        self.html = None
+        self.in_html = False
+        self.body = None
+        self.result = None
+
+    def _convert_table(self, element):
+        rows = []
+
+        for i, row in enumerate(element.rows):
+            cells = []
+
+            for cell_type, rowspan, colspan, contents in row:
+                if cell_type == 'th' and i > 0:
+                    contents = self.converter._inline('**', contents)
+
+                cells.append(Cell(cell_type, rowspan, colspan, contents))
+
+            rows.append(cells)
+
+        return self.converter._format_table(rows)
+
+    def _process(self, element):
+        name = element.name
+
+        if name == 'a' and 'name' in element.attrs:
+            needs, convert = self.anchor
+        elif name == 'a' and 'href' in element.attrs:
+            needs, convert = self.link
+        elif name in self.dispatch:
+            needs, convert = self.dispatch[name]
+        else:
+            self.converter._unknown_tags.add(name)
+            needs, convert = self.unknown
+
+        element.convert = convert
+        element.needs = needs
+
+        if needs == 'children':
+            element.children = True
+            element.parts = []
+        elif needs == 'text':
+            element.text_start = len(self.texts)
+            self.collecting += 1
+        elif needs == 'items':
+            element.items = []
+        elif needs == 'rows':
+            element.rows = []
+            self.tables.append(element)
+
+    def _end_data(self, text=True):
+        """ Add the data received since the last element, comment or processing
+        instruction as a string. """
+
+        if not self.pending:
+            return
+
+        s = ''.join(self.pending)
+        self.pending = []
+
+        if not self.preserving and not s.strip(self.ascii_spaces):
+            s = '\n' if '\n' in s else ' '
+
+        if text and self.collecting and not self.containers:
+            self.texts.append(s)
+
+        parent = self.stack[-1]
+        if parent.children:
+            parent.add_part(self.converter._compress_whitespace(s))
+
+    # --------------------------------------------------------------------------
+    # ---- Parser target interface ----
+
+    def start(self, name, attrs):
+        self._end_data()
+
+        parent = self.stack[-1]
+        element = OpenElement(name, attrs)
+
+        if name == 'body' and self.body is None and self.in_html:
+            self.body = element
+            element.children = True
+            element.parts = []
+        elif parent.children or (name == 'li' and parent.needs == 'items'):
+            self._process(element)
+
+        if parent.row is not None and name in ('td', 'th'):
+            element.cell = True
+            if not element.children:
+                element.children = True
+                element.parts = []
+
+        if name == 'tr' and self.tables:
+            element.row = []
+            for table in self.tables:
+                table.rows.append(element.row)
+
+        if name == 'html' and self.html is None:
+            self.html = element
+            self.in_html = True
+
+        if name in self.preserve_whitespace:
+            self.preserving += 1
+        if name in self.string_containers:
+            self.containers += 1
+
+        self.stack.append(element)
+
+    def end(self, name):
+        self._end_data()
+
+        element = self.stack.pop()
+        parent = self.stack[-1]
+
+        if element.name in self.preserve_whitespace:
+            self.preserving -= 1
+        if element.name in self.string_containers:
+            self.containers -= 1
+
+        if element.convert is not None:
+            if element.needs == 'text':
+                element.text = ''.join(self.texts[element.text_start:])
+                self.collecting -= 1
+                if not self.collecting:
+                    self.texts = []
+            elif element.needs == 'rows':
+                self.tables.pop()
+
+            result = element.convert(element)
+
+            if parent.children:
+                parent.add_part(result)
+            else:
+                parent.items.append(result)
+
+        if element.cell:
+            rowspan = int(element.attrs.get('rowspan', 1))
+            colspan = int(element.attrs.get('colspan', 1))
+            parent.row.append((element.name, rowspan, colspan, element.content().strip()))
+
+        if element is self.body:
+            self.result = element.content()
+        elif element is self.html:
+            self.in_html = False
+
+    def data(self, data):
+        self.pending.append(data)
+
+    def comment(self, text):
+        self._end_data()
+        self.pending.append(text)
+        self._end_data(False)
+
+    def pi(self, target, data):
+        self._end_data()
+        self.pending.append(target + ' ' + data)
+        self._end_data(False)
+
+    def doctype(self, name, pubid, system):
+        value = name or ''
+        if pubid is not None:
+            value += ' PUBLIC "%s"' % (pubid,)
+            if system is not None:
+                value += ' "%s"' % (system,)
+        elif system is not None:
+            value += ' SYSTEM "%s"' % (system,)
+
+        self._end_data()
+        self.pending.append(value)
+        self._end_data(False)
+
+    def close(self):
+        self._end_data()
+
+        if self.result is None:
+            raise ValueError('HTML document has no body')
+
+        return self.result
@@ -0,0 +1,199 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Manifest of the output generated by javasphinx-apidoc.
+
+The manifest is stored in the output directory and records, for each source
+file, its size, modification time and key (a hash of its contents and the
+compiler options) along with the documents generated from it and a hash of
+each document. An incremental run uses it to skip unchanged sources without
+reading them, and every run uses it to find outputs that are no longer
+generated.
+
+"""
+
+import hashlib
+import json
+import os
+import os.path
+
+import javasphinx.cache as cache
+
+def source_state(source_file, fingerprint):
+    """ Describe the current state of a source file for the manifest. """
+
+    st = os.stat(source_file)
+
+    f = open(source_file)
+    source = f.read()
+    f.close()
+
+    return stat_state(st, cache.source_key(fingerprint, source))
+
+def stat_state(st, key):
+    """ Describe the state of a source file for the manifest, given the result
+    of os.stat() taken before it was read and the key of its contents.
+
+    """
+
+    return {
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+        'key': key
+    }
+
+def document_digest(document):
+    return hashlib.sha1(cache.to_bytes(document)).hexdigest()
+
+class Manifest(object):
+
+    version = 1
+    filename = '.javasphinx-manifest.json'
+
+    def __init__(self, fingerprint, suffix):
+        self.fingerprint = fingerprint
+        self.suffix = suffix
+
+        # Source file -> dict with size, mtime, key, documents (a list of
+        # [package, name, digest]) and package_docs (package -> documentation
+        # from package-info.java)
+        self.sources = {}
+
+    @classmethod
+    def load(cls, destdir):
+        """ Load the manifest stored in destdir. Returns None if there is no
+        usable manifest.
+
+        """
+
+        try:
+            f = open(os.path.join(destdir, cls.filename))
+        except IOError:
+            return None
+
+        try:
+            data = json.load(f)
+        except ValueError:
+            return None
+        finally:
+            f.close()
+
+        if not isinstance(data, dict) or data.get('version') != cls.version:
+            return None
+
+        manifest = cls(data['fingerprint'], data['suffix'])
+        manifest.sources = data['sources']
+
+        return manifest
+
+    def dumps(self):
+        data = {
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'suffix': self.suffix,
+            'sources': self.sources
+        }
+
+        return json.dumps(data, sort_keys=True, separators=(',', ':'))
+
+    def path(self, destdir):
+        return os.path.join(destdir, self.filename)
+
+    def matches(self, other):
+        """ Check whether other was created with the same options, so the
+        documents it records can be reused.
+
+        """
+
+        return self.fingerprint == other.fingerprint and self.suffix == other.suffix
+
+    def is_unchanged(self, source_file, st):
+        """ Check whether the source file still has the size and modification
+        time recorded for it.
+
+        """
+
+        record = self.sources.get(source_file)
+        return record is not None and record['size'] == st.st_size and record['mtime'] == st.st_mtime
+
+    def add_source(self, source_file, state):
+        record = dict(state)
+        record['documents'] = []
+        record['package_docs'] = {}
+
+        self.sources[source_file] = record
+
+    def copy_source(self, other, source_file, state=None):
+        """ Copy the record for source_file from another manifest, optionally
+        updating its state.
+
+        """
+
+        record = dict(other.sources[source_file])
+        if state:
+            record.update(state)
+
+        self.sources[source_file] = record
+
+    def add_documents(self, source_file, documents, is_package_info_doc):
+        record = self.sources[source_file]
+
+        for fullname, (package, name, document) in sorted(documents.items()):
+            if is_package_info_doc(name):
+                record['package_docs'][package] = document
+            else:
+                record['documents'].append([package, name, document_digest(document)])
+
+    def packages_of(self, source_file):
+        """ Return the set of packages the given source file contributes to. """
+
+        record = self.sources.get(source_file)
+        if record is None:
+            return set()
+
+        packages = set(package for package, _, _ in record['documents'])
+        packages.update(record['package_docs'])
+
+        return packages
+
+    def digests(self):
+        """ Return a dict mapping (package, name) to document digest. """
+
+        return dict(((package, name), digest)
+                    for source_file in sorted(self.sources)
+                    for package, name, digest in self.sources[source_file]['documents'])
+
+    def packages(self):
+        """ Return a dict mapping each package to its documentation, and a dict
+        mapping each package to the set of type names documented within it.
+
+        """
+
+        packages = {}
+        package_contents = {}
+
+        for source_file in sorted(self.sources):
+            record = self.sources[source_file]
+
+            for package, name, _ in record['documents']:
+                packages.setdefault(package, '')
+                package_contents.setdefault(package, set()).add(name)
+
+            for package, documentation in record['package_docs'].items():
+                packages[package] = documentation
+
+        return packages, package_contents
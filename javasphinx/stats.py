@@ -0,0 +1,307 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Timing instrumentation for javasphinx-apidoc.
+
+Code is divided into phases using span() and the timed() decorator. Phases may
+nest; each phase is charged only for the time not spent in nested phases, so
+the phase times add up to the total. Spans given a name (the file being
+processed), and spans nested within them, which take the name of the enclosing
+span, are also recorded as Chrome trace events when tracing.
+
+Instrumentation is disabled until enable() is called, in which case span()
+returns a shared no-op context manager and timed() functions call straight
+through.
+
+"""
+
+import collections
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    process_time = time.process_time
+except AttributeError:
+    process_time = time.clock
+
+# The active Recorder, or None while instrumentation is disabled
+recorder = None
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, documents):
+        pass
+
+null_span = NullSpan()
+
+class Span(object):
+    def __init__(self, recorder, phase, name):
+        self.recorder = recorder
+        self.phase = phase
+        self.name = name
+
+    def __enter__(self):
+        self.recorder.enter(self.phase, self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.exit()
+        return False
+
+class FileSpan(object):
+    """ Measures the total time spent on a source file, and counts the types and
+    members documented from it.
+
+    """
+
+    directive_re = re.compile(r'^\s*\.\. java:(type|field|method|constructor)::', re.MULTILINE)
+
+    def __init__(self, recorder, source_file):
+        self.recorder = recorder
+        self.source_file = source_file
+        self.types = 0
+        self.members = 0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_file(self.source_file, time.time() - self.start, self.types, self.members)
+        return False
+
+    def count(self, documents):
+        for _, _, document in documents.values():
+            for directive in self.directive_re.findall(document):
+                if directive == 'type':
+                    self.types += 1
+                else:
+                    self.members += 1
+
+class Recorder(object):
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.wall = collections.defaultdict(float)
+        self.cpu = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+
+        # (source file, wall time, types, members) for each processed file
+        self.files = []
+
+        # Chrome trace events for named spans and the spans nested within them
+        self.events = []
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def enter(self, phase, name=None):
+        stack = self.stack()
+
+        # Unnamed spans, such as those of timed() functions, belong to the
+        # file of the enclosing span
+        if name is None and stack:
+            name = stack[-1][1]
+
+        # Each frame holds the phase, name, start times and the time spent in
+        # nested phases
+        stack.append([phase, name, time.time(), process_time(), 0.0, 0.0])
+
+    def exit(self):
+        end_wall = time.time()
+        end_cpu = process_time()
+
+        stack = self.stack()
+        phase, name, start_wall, start_cpu, child_wall, child_cpu = stack.pop()
+
+        wall = end_wall - start_wall
+        cpu = end_cpu - start_cpu
+
+        if stack:
+            stack[-1][4] += wall
+            stack[-1][5] += cpu
+
+        with self.lock:
+            self.wall[phase] += wall - child_wall
+            self.cpu[phase] += cpu - child_cpu
+            self.calls[phase] += 1
+
+            if self.trace and name is not None:
+                self.events.append({
+                    'name': phase,
+                    'cat': 'apidoc',
+                    'ph': 'X',
+                    'ts': int(start_wall * 1e6),
+                    'dur': int(wall * 1e6),
+                    'pid': os.getpid(),
+                    'tid': threading.current_thread().ident,
+                    'args': {'file': name}
+                })
+
+    def is_active(self, phase):
+        stack = self.stack()
+        return bool(stack) and stack[-1][0] == phase
+
+    def add_file(self, source_file, wall, types, members):
+        with self.lock:
+            self.files.append((source_file, wall, types, members))
+
+            if self.trace:
+                self.events.append({
+                    'name': os.path.basename(source_file),
+                    'cat': 'file',
+                    'ph': 'X',
+                    'ts': int((time.time() - wall) * 1e6),
+                    'dur': int(wall * 1e6),
+                    'pid': os.getpid(),
+                    'tid': threading.current_thread().ident,
+                    'args': {'file': source_file, 'types': types, 'members': members}
+                })
+
+    def take_state(self):
+        """ Return and reset the data recorded so far, for merging into the
+        recorder of another process.
+
+        """
+
+        with self.lock:
+            state = (dict(self.wall), dict(self.cpu), dict(self.calls), self.files, self.events)
+            self.reset()
+
+        return state
+
+    def merge_state(self, state):
+        wall, cpu, calls, files, events = state
+
+        with self.lock:
+            for phase, value in wall.items():
+                self.wall[phase] += value
+            for phase, value in cpu.items():
+                self.cpu[phase] += value
+            for phase, value in calls.items():
+                self.calls[phase] += value
+
+            self.files.extend(files)
+            self.events.extend(events)
+
+    def report(self, total_wall, slowest=10, cache_stats=None):
+        lines = ['%-12s %10s %10s %10s' % ('Phase', 'Wall (s)', 'CPU (s)', 'Calls')]
+
+        for phase in sorted(self.wall, key=lambda p: -self.wall[p]):
+            lines.append('%-12s %10.3f %10.3f %10d' % (phase, self.wall[phase], self.cpu[phase],
+                                                      self.calls[phase]))
+
+        lines.append('Total wall time: %.3f s' % (total_wall,))
+
+        types = sum(f[2] for f in self.files)
+        members = sum(f[3] for f in self.files)
+        lines.append('Source files: %d, types: %d, members: %d' % (len(self.files), types, members))
+
+        if cache_stats is not None:
+            lines.append(format_hits('Cache', cache_stats.hits, cache_stats.misses))
+
+        if slowest and self.files:
+            lines.append('Slowest source files:')
+            for source_file, wall, types, members in sorted(self.files, key=lambda f: -f[1])[:slowest]:
+                lines.append('  %8.3f s  %s (%d types, %d members)' % (wall, source_file, types, members))
+
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        f = open(path, 'w')
+        try:
+            json.dump({'traceEvents': sorted(self.events, key=lambda e: e['ts']),
+                       'displayTimeUnit': 'ms'}, f)
+        finally:
+            f.close()
+
+def format_hits(label, hits, misses):
+    """ Describe the hits and misses of a cache or memo along with its hit
+    ratio.
+
+    """
+
+    lookups = hits + misses
+    ratio = 100.0 * hits / lookups if lookups else 0.0
+
+    return '%s hits: %d, misses: %d (%.1f%% hit ratio)' % (label, hits, misses, ratio)
+
+def enable(trace=False):
+    global recorder
+    recorder = Recorder(trace)
+    return recorder
+
+def span(phase, name=None):
+    """ Return a context manager charging the time spent within it to the given
+    phase.
+
+    """
+
+    if recorder is None:
+        return null_span
+    return Span(recorder, phase, name)
+
+def file_span(source_file):
+    if recorder is None:
+        return null_span
+    return FileSpan(recorder, source_file)
+
+def timed(phase):
+    """ Decorator charging the time spent in the decorated function to the
+    given phase. Recursive calls are only timed once.
+
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            r = recorder
+            if r is None or r.is_active(phase):
+                return f(*args, **kwargs)
+
+            r.enter(phase)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                r.exit()
+        return wrapper
+    return decorator
+
+def take_worker_state():
+    if recorder is None:
+        return None
+    return recorder.take_state()
+
+def merge_worker_state(state):
+    if recorder is not None and state is not None:
+        recorder.merge_state(state)
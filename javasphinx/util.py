@@ -17,10 +17,13 @@
 from __future__ import unicode_literals
 from builtins import str
 
+import collections
 import logging
 import re
 import sys
 
+import javasphinx.stats as stats
+
 class StringBuilder(list):
     def build(self):
         return str(self)
@@ -44,29 +47,17 @@ class Directive(object):
         assert o is not None
         self.content.append(o)
 
+    @stats.timed('build')
     def build(self):
-        doc = Document()
-        doc.add_line('.. %s:: %s' % (self.type, self.argument))
-
-        for name, value in self.options:
-            doc.add_line('   :%s: %s\n' % (name, value))
-
-        content = Document()
-
-        for obj in self.content:
-            content.add_object(obj)
-
-        doc.clear()
-        for line in content.build().splitlines():
-            doc.add_line('   ' + line)
-        doc.clear()
+        output = StringBuilder()
+        render(self, output.append)
+        return output.build()
 
-        return doc.build()
+    def write(self, f):
+        """ Write the directive to a file opened for writing text. """
+        render(self, f.write)
 
 class Document(object):
-    remove_trailing_whitespace_re = re.compile('[ \t]+$', re.MULTILINE)
-    collapse_empty_lines_re = re.compile('\n' + '{3,}', re.DOTALL)
-
     def __init__(self):
         self.content = []
 
@@ -89,26 +80,237 @@ class Document(object):
     def clear(self):
         self.add('\n\n')
 
+    @stats.timed('build')
     def build(self):
         output = StringBuilder()
+        render(self, output.append)
+        return output.build()
+
+    def write(self, f):
+        """ Write the document to a file opened for writing text. """
+        render(self, f.write)
+
+class WhitespaceFilter(object):
+    """ Removes trailing whitespace from each line of the text fed to it and
+    collapses runs of more than two newlines, passing the result on to write.
+
+    Text is passed on as soon as it is final. Only a trailing run of spaces,
+    tabs and newlines is held back, since it depends on what follows it; its
+    newlines are counted rather than kept, so the filter works in linear time
+    regardless of how the text is split into pieces.
+
+    """
+
+    remove_trailing_whitespace_re = re.compile('(?<![ \t])[ \t]+$', re.MULTILINE)
+    collapse_empty_lines_re = re.compile('\n' + '{3,}', re.DOTALL)
+
+    def __init__(self, write):
+        self.write = write
+
+        self.newlines = 0
+        self.spaces = ''
+
+    def feed(self, s):
+        head = s.rstrip(' \t\n')
+        tail = s[len(head):]
+
+        if head:
+            head = '\n' * self.newlines + self.spaces + head
+
+            # Most pieces are a single line, which needs neither
+            if ' \n' in head or '\t\n' in head:
+                head = self.remove_trailing_whitespace_re.sub('', head)
+            if '\n\n\n' in head:
+                head = self.collapse_empty_lines_re.sub('\n\n', head)
+
+            self.write(head)
+
+            self.newlines = 0
+            self.spaces = ''
+
+        i = tail.rfind('\n')
+        if i == -1:
+            self.spaces += tail
+        else:
+            # Three newlines collapse just like any longer run does
+            self.newlines = min(3, self.newlines + tail.count('\n'))
+            self.spaces = tail[i + 1:]
+
+    def close(self):
+        if self.newlines:
+            self.write('\n' * min(2, self.newlines))
+
+        self.newlines = 0
+        self.spaces = ''
+
+class IndentFilter(object):
+    """ Indents each line of the text fed to it, passing the result on to
+    write. Every line boundary recognized by str.splitlines() becomes a
+    newline.
+
+    Empty lines are not indented; the indentation would be removed as trailing
+    whitespace anyway.
+
+    """
+
+    line_boundary_re = re.compile('\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+    def __init__(self, write, indent='   '):
+        self.write = write
+        self.indent = indent
+
+        self.line_start = True
+        self.after_cr = False
+
+    def feed(self, s):
+        if not s:
+            return
+
+        # A \r ending the previous piece and a \n starting this one are a
+        # single line boundary
+        if self.after_cr and s.startswith('\n'):
+            s = s[1:]
+
+        self.after_cr = s.endswith('\r')
+
+        output = []
+
+        for i, line in enumerate(self.line_boundary_re.split(s)):
+            if i:
+                output.append('\n')
+                self.line_start = True
+
+            if line:
+                if self.line_start:
+                    output.append(self.indent)
+                    self.line_start = False
+                output.append(line)
+
+        self.write(''.join(output))
+
+def render(obj, write):
+    """ Render a Document or Directive, passing the output to write in pieces.
+
+    The tree is walked once. Building a Document or Directive removes trailing
+    whitespace and collapses empty lines in its output, and each directive
+    indents the output of its content. Applying this once to the whole output
+    gives the same result as applying it to every nested Document in turn, so
+    only the content of each directive goes through filters of its own before
+    being indented.
+
+    """
+
+    output = WhitespaceFilter(write)
+
+    if isinstance(obj, Directive):
+        render_directive(obj, output)
+    else:
+        render_document(obj.content, output)
+
+    output.close()
+
+def render_document(content, output):
+    for obj in content:
+        if isinstance(obj, Directive):
+            output.feed('\n\n')
+            render_directive(obj, output)
+            output.feed('\n\n')
+        elif isinstance(obj, Document):
+            render_document(obj.content, output)
+        else:
+            output.feed(str(obj))
+
+    output.feed('\n\n')
+
+def render_directive(directive, output):
+    output.feed('.. %s:: %s\n' % (directive.type, directive.argument))
+
+    for name, value in directive.options:
+        output.feed('   :%s: %s\n\n' % (name, value))
+
+    output.feed('\n\n')
+
+    content = WhitespaceFilter(IndentFilter(output.feed).feed)
+    render_document(directive.content, content)
+    content.close()
+
+    output.feed('\n\n\n\n')
+
+class LRU(object):
+    """ Least recently used mapping. Once the entries take up more than
+    max_size, the least recently used are evicted; a max_size of 0 keeps
+    nothing. Each entry takes up 1 unless a sizeof function, called with the
+    key and the value, is given.
+
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+
+        # Key -> (value, size), least recently used first
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """ Return the value stored under key, or None. """
+
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries[key] = entry
+
+        return entry[0]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous[1]
+
+        size = self.sizeof(key, value) if self.sizeof else 1
+        self.entries[key] = (value, size)
+        self.size += size
+
+        self.evict()
+
+    def resize(self, max_size):
+        self.max_size = max_size
+        self.evict()
+
+    def evict(self):
+        while self.entries and self.size > self.max_size:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evicted += 1
 
-        for obj in self.content:
-            if isinstance(obj, Directive):
-                output.append('\n\n')
-                output.append(obj.build())
-                output.append('\n\n')
-            elif isinstance(obj, Document):
-                output.append(obj.build())
-            else:
-                output.append(str(obj))
+    def items(self):
+        """ Return the (key, value) pairs, least recently used first. """
+        return [(key, value) for key, (value, _) in self.entries.items()]
 
-        output.append('\n\n')
+def text_size(key, value):
+    """ Size of a memo entry made up of text: the bytes taken by the UTF-8
+    encoding of the value and of the strings in the key tuple.
 
-        output = str(output)
-        output = self.remove_trailing_whitespace_re.sub('', output)
-        output = self.collapse_empty_lines_re.sub('\n\n', output)
+    """
 
-        return output
+    return sum(len(s.encode('utf-8')) for s in key + (value,) if isinstance(s, str))
 
 def error(s, *args, **kwargs):
     logging.error(s, *args, **kwargs)
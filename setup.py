@@ -14,12 +14,27 @@
 # limitations under the License.
 #
 
+import os.path
+import re
+
 from setuptools import setup
 
+def read_version():
+    """ Read __version__ from javasphinx/__init__.py without importing the
+    package, whose dependencies may not be installed yet.
+
+    """
+
+    f = open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'javasphinx', '__init__.py'))
+    try:
+        return re.search(r"^__version__ = '([^']+)'", f.read(), re.MULTILINE).group(1)
+    finally:
+        f.close()
+
 setup(
     name = "javasphinx",
     packages = ["javasphinx"],
-    version = "0.9.15",
+    version = read_version(),
     author = "Chris Thunes",
     author_email = "cthunes@brewtab.com",
     url = "http://github.com/bronto/javasphinx",
@@ -0,0 +1,144 @@
+#
+# Copyright 2012-2015 Bronto Software, Inc. and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Checks that the faster conversion paths of htmlrst.Converter produce the same
+reST as the full HTML conversion: the plain text fast path of convert(), the
+batched convert_many(), the conversion memo and the stream engine. A fixed
+subset of the strings checked by benchmarks/differential.py.
+
+"""
+
+from __future__ import unicode_literals
+
+import unittest
+
+import javasphinx.htmlrst as htmlrst
+
+fragments = [
+    # Plain text
+    '', '   ', 'hello', '  hello   world ', 'tab\tand\nnewline', 'a\n\n\nb',
+    'no-break\xa0space', 'em\u2003space', 'asterisks * and `backticks`', 'pipe | and \\ backslash',
+
+    # Byte order marks, which Beautiful Soup drops at the start of a document
+    '\ufeff', '\ufeffhello', '\ufeff hello  world ', '\ufeff\ufeffhello', '\ufeff<b>bold</b>',
+    '\ufeff{@code x}', '\ufeff&lt;', ' \ufeffhello', 'hello\ufeff', 'a\ufeffb <i>c</i>',
+
+    # Entities and NUL characters
+    'a &lt; b', 'a &amp c', '&nbsp;x', '&', 'nul\x00char',
+
+    # Markup
+    '<b>bold</b>', '<i>nested <b>bold</b></i>', '<code>x</code> and <tt>y</tt>',
+    '<p>First</p><p>Second</p>', 'line<br>break', '<h3>Heading</h3>text',
+    '<ul><li>a</li><li>b</li></ul>', '<ol><li>one</li><li>two</li></ol>',
+    '<pre>code\n  indented</pre>', '<table><tr><th>h</th></tr><tr><td>c</td></tr></table>',
+    '<a name="anchor">x', '<a href="#y">link</a>', 'x<sub>1</sub> y<sup>2</sup>', '<hr>',
+    '<div>block</div>', '</b> stray end tag', '</p>', '<!-- comment --> text',
+
+    # Markup parsed differently at the start of a document
+    '<title>t</title>body', '<!DOCTYPE html>text', '<script>x < y</script>after',
+    '<html><body>text</body></html>',
+
+    # Inline Javadoc tags
+    '{@code List<String>}', '{@literal a & b}', '{@docRoot}/index.html', '{@link Foo}',
+    '{@link Foo#bar(int) label}', '{@linkplain #baz() the baz}', '{@code {nested}}',
+    '{@ unknown', 'unbalanced {@code x', '{ braces }',
+]
+
+class Failure(object):
+    """ An exception raised by a conversion, comparing equal to failures with
+    the same exception type.
+
+    """
+
+    def __init__(self, exception):
+        self.exception = exception
+
+    def __eq__(self, other):
+        return isinstance(other, Failure) and type(self.exception) is type(other.exception)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'exception: %r' % (self.exception,)
+
+def outcome(f, *args):
+    try:
+        return f(*args)
+    except Exception as e:
+        return Failure(e)
+
+class ConverterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.converter = htmlrst.Converter('lxml')
+        self.expected = [outcome(self.converter._convert_html, s) for s in fragments]
+
+    def test_plain_text(self):
+        self.assertEqual(self.converter.convert('  hello   world '), 'hello world')
+        self.assertEqual(self.converter.convert('tab\tand\nnewline'), 'tab and newline')
+
+    def test_convert(self):
+        for s, expected in zip(fragments, self.expected):
+            self.assertEqual(outcome(self.converter.convert, s), expected, repr(s))
+
+    def test_convert_many(self):
+        for s, expected in zip(fragments, self.expected):
+            if isinstance(expected, Failure):
+                self.assertEqual(outcome(self.converter.convert_many, [s]), expected, repr(s))
+            else:
+                self.assertEqual(self.converter.convert_many([s]), [expected], repr(s))
+
+        # convert_many() raises if converting any of the fragments raises
+        converted = [(s, expected) for s, expected in zip(fragments, self.expected)
+                     if not isinstance(expected, Failure)]
+        self.assertEqual(self.converter.convert_many([s for s, _ in converted]),
+                         [expected for _, expected in converted])
+
+    def test_memo(self):
+        converter = htmlrst.Converter('lxml', htmlrst.ConversionMemo())
+
+        # Converted once to fill the memo, then again from it
+        for _ in range(2):
+            for s, expected in zip(fragments, self.expected):
+                self.assertEqual(outcome(converter.convert, s), expected, repr(s))
+
+    def test_stream(self):
+        converter = htmlrst.Converter('stream')
+
+        # The stream engine fails differently on documents without a body
+        for s, expected in zip(fragments, self.expected):
+            result = outcome(converter._convert_html, s)
+            if isinstance(expected, Failure):
+                self.assertTrue(isinstance(result, Failure), repr(s))
+            else:
+                self.assertEqual(result, expected, repr(s))
+
+    def test_inline_tags(self):
+        for s in fragments:
+            scanned = self.converter._preprocess_inline_javadoc_scan(s)
+            if scanned is None:
+                continue
+
+            expected = s
+            for start, f in self.converter._inline_tags:
+                expected = self.converter._preprocess_inline_javadoc_replace(start[2:], f, expected)
+
+            self.assertEqual(scanned, expected, repr(s))
+
+if __name__ == '__main__':
+    unittest.main()